@@ -0,0 +1,156 @@
+"""
+This file contains the accuracy tracker : it measures how good the forecasts of each model were once the actual data is known.
+
+At every run, the actual percentage of renewable energy of the hours that settled since the previous run (the hours after the watermark
+of the country) is joined with all the forecasts issued for those hours (see `PredictionStore.get_forecasts`). An hour is settled once it is
+`publication_lag_hours` older than the last hour of actual data : ENTSOE can still complete or correct the values of more recent hours.
+Hours whose values were filled by `entsoeAPI.refine_data` (column `imputed`) are not scored. The errors (forecast - actual)
+are added to running aggregates kept per country, model and lead time (1 to 48 hours) : the number of forecasts, the sum of the errors,
+of the absolute errors and of the squared errors. The MAE, the RMSE and the bias are computed from these sums, so the history never
+has to be scanned again. Each forecast is scored once since only hours after the watermark are scored, and the watermark only moves
+up to the last settled hour.
+
+The aggregates are stored in the SQLite database `data/store/accuracy.db` (a few rows per model). `get_accuracy` returns the metrics
+per lead time and `get_model_scores` per model. `get_best_model` is used by `predictionModel.get_latest_model_name_for` when
+the environment variable `PREDICTIONS_MODEL_SELECTION` is `accuracy`.
+"""
+
+import os
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+from predictionStore import to_epoch_seconds
+
+
+class AccuracyTracker:
+    """Running forecast errors per country, model and lead time
+    :param db_path : path of the database file
+    :param max_lead_time : forecasts with a longer lead time are not scored
+    :param publication_lag_hours : hours more recent than this before the last hour of actual data are not scored yet
+    """
+
+    def __init__(self, db_path="./data/store/accuracy.db", max_lead_time=48, publication_lag_hours=24):
+        self.db_path = db_path
+        self.max_lead_time = max_lead_time
+        self.publication_lag_seconds = int(publication_lag_hours * 3600)
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Returns the connection to the database, creating the database at the first call"""
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS accuracy (
+                country TEXT NOT NULL,
+                model TEXT NOT NULL,
+                leadTime INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                sumError REAL NOT NULL,
+                sumAbsError REAL NOT NULL,
+                sumSquaredError REAL NOT NULL,
+                PRIMARY KEY (country, model, leadTime)
+            ) WITHOUT ROWID""")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS watermarks (
+                country TEXT PRIMARY KEY,
+                lastHour INTEGER NOT NULL
+            )""")
+            self._connection.commit()
+        return self._connection
+
+    def get_watermark(self, country):
+        """Returns the last hour of actual data scored for the country (UTC epoch seconds) or None"""
+        with self._lock:
+            row = self._connect().execute("SELECT lastHour FROM watermarks WHERE country = ?", (country,)).fetchone()
+        return row[0] if row else None
+
+    def update(self, country, actuals, store):
+        """Scores the forecasts of the settled hours of `actuals` that were not scored yet
+        :param actuals : pd.DataFrame with the columns 'startTimeUTC' ('YYYYMMDDhhmm' in UTC or datetimes), 'percentRenewable' and
+        optionally 'imputed' (True for the hours whose values were filled, which are not scored). It must include the most recent hours
+        fetched (even if imputed) since the settled hours are counted from the last hour
+        :param store : `PredictionStore` in which the issued forecasts are read
+        :return the number of forecasts scored
+        """
+        hours = to_epoch_seconds(actuals["startTimeUTC"]).to_numpy()
+        if len(hours) == 0:
+            return 0
+        last_settled = hours.max() - self.publication_lag_seconds
+        watermark = self.get_watermark(country)
+        new = (hours > watermark if watermark is not None else np.ones(len(hours), dtype=bool)) & (hours <= last_settled)
+        if not new.any():
+            return 0
+        values = actuals["percentRenewable"].to_numpy(dtype=np.float64)
+        measured = new & ~np.isnan(values)
+        if "imputed" in actuals.columns:
+            measured &= ~actuals["imputed"].to_numpy(dtype=bool)
+        actual = pd.DataFrame({"startTimeUTC": pd.to_datetime(hours[measured], unit="s"), "percentRenewable": values[measured]})
+        if len(actual) == 0:
+            self._set_watermark(country, int(hours[new].max()))
+            return 0
+        forecasts = store.get_forecasts(country, actual["startTimeUTC"].min(), actual["startTimeUTC"].max())
+        forecasts = forecasts[forecasts["leadTime"].between(1, self.max_lead_time)]
+        # forecasts without a model (imported from the prediction files) are not scored
+        scored = forecasts.dropna(subset=["model"]).merge(actual, on="startTimeUTC")
+        scored["error"] = scored["percentRenewableForecast"] - scored["percentRenewable"]
+        scored["absError"] = scored["error"].abs()
+        scored["squaredError"] = scored["error"] ** 2
+        sums = scored.groupby(["model", "leadTime"]).agg(
+            count=("error", "size"), sumError=("error", "sum"),
+            sumAbsError=("absError", "sum"), sumSquaredError=("squaredError", "sum")).reset_index()
+        rows = [(country, row.model, int(row.leadTime), int(row.count), float(row.sumError), float(row.sumAbsError),
+                 float(row.sumSquaredError)) for row in sums.itertuples(index=False)]
+        with self._lock:
+            connection = self._connect()
+            connection.executemany("""INSERT INTO accuracy VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (country, model, leadTime) DO UPDATE SET
+                count = count + excluded.count, sumError = sumError + excluded.sumError,
+                sumAbsError = sumAbsError + excluded.sumAbsError, sumSquaredError = sumSquaredError + excluded.sumSquaredError""", rows)
+            connection.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?)", (country, int(hours[new].max())))
+            connection.commit()
+        return len(scored)
+
+    def _set_watermark(self, country, last_hour):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?)", (country, last_hour))
+            connection.commit()
+
+    @staticmethod
+    def _add_metrics(data):
+        data["mae"] = data["sumAbsError"] / data["count"]
+        data["rmse"] = np.sqrt(data["sumSquaredError"] / data["count"])
+        data["bias"] = data["sumError"] / data["count"]
+        return data.drop(columns=["sumError", "sumAbsError", "sumSquaredError"])
+
+    def get_accuracy(self, country=None, model=None) -> pd.DataFrame:
+        """Returns the accuracy per country, model and lead time
+        :param country, model : filters (default : all)
+        :return pd.DataFrame with the columns country, model, leadTime, count, mae, rmse and bias
+        """
+        conditions = [(column, value) for column, value in [("country", country), ("model", model)] if value is not None]
+        where = (" WHERE " + " AND ".join(f"{column} = ?" for column, _ in conditions)) if conditions else ""
+        with self._lock:
+            data = pd.read_sql_query("SELECT * FROM accuracy" + where + " ORDER BY country, model, leadTime",
+                                     self._connect(), params=[value for _, value in conditions])
+        return self._add_metrics(data)
+
+    def get_model_scores(self, country, max_lead_time=None) -> pd.DataFrame:
+        """Returns the accuracy of each model of the country over all the lead times up to `max_lead_time` (default : all)
+        :return pd.DataFrame indexed by model with the columns count, mae, rmse and bias, sorted by MAE
+        """
+        max_lead_time = max_lead_time or self.max_lead_time
+        with self._lock:
+            data = pd.read_sql_query("""SELECT model, SUM(count) AS count, SUM(sumError) AS sumError, SUM(sumAbsError) AS sumAbsError,
+                SUM(sumSquaredError) AS sumSquaredError FROM accuracy WHERE country = ? AND leadTime <= ? GROUP BY model""",
+                                     self._connect(), params=(country, max_lead_time), index_col="model")
+        return self._add_metrics(data).sort_values("mae")
+
+    def get_best_model(self, country, model_names, min_count=480):
+        """Returns the model with the lowest MAE among `model_names` that have at least `min_count` scored forecasts, or None"""
+        scores = self.get_model_scores(country)
+        scores = scores[scores.index.isin(model_names) & (scores["count"] >= min_count)]
+        return scores.index[0] if len(scores) else None
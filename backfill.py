@@ -0,0 +1,144 @@
+"""
+This file contains the backfill mode : generating all the hourly forecasts that a model would have issued over a past time period.
+It is used to evaluate model versions and to rebuild the prediction files after an outage.
+
+The actual generation data for the whole period is fetched once. For each hour of the period, the input window of the model
+is the last n hourly values up to that hour (n being the input sequence of the model) and the forecast covers the next 48 hours.
+The input windows are views of the same array (no copy) and are run through the forecast engine in large batches.
+
+Usage : `python backfill.py <country> <start> <end> [--model <model name>] [--rebuild]`
+Start and end are the first and the last hour (UTC) of input data for which a forecast is generated, e.g. 2023-09-01T00:00
+With `--rebuild`, only the forecasts for hours within the retention of the prediction store (`PREDICTIONS_STORE_RETENTION_DAYS`)
+are stored : older forecasts would be deleted by the retention in the same write. They are skipped with a warning and are only saved
+in the csv file of the backfill. Increase `PREDICTIONS_STORE_RETENTION_DAYS` to rebuild an older period.
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import entsoeAPI as en
+import predictionModel as ml
+import savePredictions as sp
+
+
+def get_history(country, start, end, input_sequence) -> pd.Series:
+    """Returns the hourly percentage of renewable energy of the country from `input_sequence` hours before start up to end.
+    The series has an hourly UTC index without gaps : hours without data have the value NaN
+    The generation cache of the hourly runs is bypassed, so a backfill never changes it
+    :param start, end : pd.Timestamp (UTC)
+    """
+    first_hour = start - pd.Timedelta(hours=input_sequence - 1)
+    data = en.get_actual_percent_renewable(
+        country, first_hour.strftime('%Y%m%d%H%M'), end.strftime('%Y%m%d%H%M'), True, use_cache=False)
+    hours = pd.date_range(first_hour, end, freq="60min")
+    return data["percentRenewable"].reindex(hours).astype(float)
+
+
+def get_input_windows(history, input_sequence):
+    """Returns the input windows of all the hours of the history for which a full window is available
+    :return (array of shape (number of windows, input_sequence) which is a view of the history, DatetimeIndex of the last hour of each window)
+    """
+    values = history.to_numpy()
+    windows = sliding_window_view(values, input_sequence)
+    ends = history.index[input_sequence - 1:]
+    # windows that contain hours without data cannot be used
+    valid = ~np.isnan(windows).any(axis=1)
+    return windows[valid], ends[valid]
+
+
+def run_backfill(country, start, end, model_name=None, batch_size=512) -> pd.DataFrame:
+    """Returns the forecasts that the model would have issued for each hour between start and end
+    :param country : 2 letter country code
+    :param start, end : first and last hour of input data for which a forecast is generated (anything accepted by pd.Timestamp, in UTC)
+    :param model_name : model to run. Defaults to the latest model of the country
+    :param batch_size : number of forecasts computed in one batch
+    :return pd.DataFrame with the columns : inputEndUTC (last hour of the input window), startTimeUTC (forecast hour),
+    leadTime (hours between the end of the input and the forecast hour, 1 to 48), percentRenewableForecast, model
+    """
+    if model_name is None:
+        model_name = ml.get_latest_model_name_for(country)
+    input_sequence = ml.get_model_metadata(model_name)["input_sequence"]
+    start = pd.Timestamp(start, tz="UTC").floor("60min")
+    end = pd.Timestamp(end, tz="UTC").floor("60min")
+    history = get_history(country, start, end, input_sequence)
+    windows, ends = get_input_windows(history, input_sequence)
+    skipped = len(history) - input_sequence + 1 - len(windows)
+    if skipped > 0:
+        print(f"Skipped {skipped} hours with incomplete input data")
+    engine = ml.registry.get_engine(model_name, input_sequence)
+    steps = engine.steps
+    forecasts = np.empty((len(windows), steps))
+    for first in range(0, len(windows), batch_size):
+        forecasts[first:first + batch_size] = engine.forecast(windows[first:first + batch_size])
+        print(f"Forecasts computed : {min(first + batch_size, len(windows))}/{len(windows)}")
+    # same rounding as predictionModel.get_forecast_frame
+    forecasts = np.maximum(np.rint(forecasts), 0).astype(int)
+    lead_times = np.arange(1, steps + 1)
+    forecast_hours = pd.to_datetime(
+        (ends.asi8[:, None] + lead_times[None, :] * pd.Timedelta(hours=1).value).ravel(), utc=True)
+    return pd.DataFrame({
+        "inputEndUTC": np.repeat(ends.strftime('%Y%m%d%H%M'), steps),
+        "startTimeUTC": forecast_hours.strftime('%Y%m%d%H%M'),
+        "leadTime": np.tile(lead_times, len(windows)),
+        "percentRenewableForecast": forecasts.ravel(),
+        "model": model_name
+    })
+
+
+def get_latest_forecasts(backfill) -> pd.DataFrame:
+    """Returns, for each forecast hour, the value of the most recently issued forecast (the one a live run would have stored last)"""
+    latest = backfill.sort_values(["inputEndUTC", "startTimeUTC"]).drop_duplicates(subset="startTimeUTC", keep="last")
+    return latest[["startTimeUTC", "percentRenewableForecast"]].sort_values("startTimeUTC").reset_index(drop=True)
+
+
+def get_retained_forecasts(backfill, retention_start) -> pd.DataFrame:
+    """Returns the forecasts of the backfill for hours kept by the retention of the prediction store
+    :param retention_start : first hour kept by the store (naive datetime in UTC, see `PredictionStore.get_retention_start`)
+    """
+    hours = pd.to_datetime(backfill["startTimeUTC"], format='%Y%m%d%H%M')
+    return backfill[hours >= retention_start]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates the forecasts a model would have issued over a past time period")
+    parser.add_argument("country", help="2 letter country code")
+    parser.add_argument("start", help="first hour (UTC) of input data, e.g. 2023-09-01T00:00")
+    parser.add_argument("end", help="last hour (UTC) of input data")
+    parser.add_argument("--model", default=None, help="name of the model file (default : latest model of the country)")
+    parser.add_argument("--batch-size", type=int, default=512, help="number of forecasts computed in one batch")
+    parser.add_argument("--output", default=None,
+                        help="csv file where all the forecasts are saved (default : data/backfill/<country>_<model>_<start>_<end>.csv)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="also store the forecasts in the prediction store and rebuild the predictions file of the country. "
+                        "Forecasts for hours older than PREDICTIONS_STORE_RETENTION_DAYS are skipped")
+    args = parser.parse_args()
+    sp.loadEnv()
+    backfill = run_backfill(args.country, args.start, args.end, args.model, args.batch_size)
+    output = args.output
+    if output is None:
+        model = backfill["model"].iloc[0].replace(".h5", "") if len(backfill) else args.model
+        output = os.path.join("./data/backfill", "_".join(
+            [args.country, str(model), pd.Timestamp(args.start).strftime('%Y%m%d%H%M'), pd.Timestamp(args.end).strftime('%Y%m%d%H%M')]) + ".csv")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    backfill.to_csv(output, index=False)
+    print(f"{len(backfill)} forecasts saved in {output}")
+    if args.rebuild:
+        retained = get_retained_forecasts(backfill, sp.predictionStore.get_retention_start())
+        if len(retained) < len(backfill):
+            print(f"Warning : {len(backfill) - len(retained)} forecasts for hours older than the retention of the prediction store "
+                  f"(PREDICTIONS_STORE_RETENTION_DAYS) are not stored")
+        if len(retained) == 0:
+            print("Nothing to rebuild : the whole period is older than the retention of the prediction store")
+            return
+        # each forecast is stored as issued one hour after the end of its input window, when the live run would have generated it
+        issued = pd.to_datetime(retained["inputEndUTC"], format='%Y%m%d%H%M') + pd.Timedelta(hours=1)
+        sp.predictionStore.write(args.country, retained, issued_at=issued, model=retained["model"].iloc[0])
+        sp.exportPredictionsFile(args.country)
+        print(f"Prediction store and predictions file rebuilt with {len(retained)} forecasts")
+
+
+if __name__ == "__main__":
+    main()
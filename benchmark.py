@@ -0,0 +1,522 @@
+"""
+This file contains benchmarks for the performance critical parts of the prediction tool.
+Each benchmark prints its timings and returns them as a dictionary.
+
+Usage : `python benchmark.py <name of the benchmark> [--record]` (run without arguments to list available benchmarks)
+With `--record`, the results are appended to `data/benchmarks/<name>.jsonl` and compared with the previous record.
+The benchmarks of the complete tool run without the ENTSOE portal and Redis, using the stand-ins of `benchmarkFixtures.py`.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+
+def time_it(func, repeat=5):
+    """Runs the function `repeat` times and returns the best and the mean duration (in seconds)"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return {"best": min(durations), "mean": sum(durations) / len(durations)}
+
+
+def synthetic_percent_renewable(length, seed=0):
+    """Returns a synthetic hourly percent renewable series (daily cycle plus noise) of the given length"""
+    rng = np.random.default_rng(seed)
+    hours = np.arange(length)
+    values = 50 + 30 * np.sin(2 * np.pi * hours / 24) + rng.normal(0, 5, length)
+    return values.clip(0, 100).round()
+
+
+def legacy_forecast(model, values, seq_length, steps=48):
+    """The forecast loop used by `run_model` before the forecast engine was added (one `predict` call per step)"""
+    from sklearn.preprocessing import StandardScaler
+    scaler = StandardScaler()
+    forecast_values_total = []
+    prev_values_total = np.asarray(values, dtype=np.float64)
+    for _ in range(steps):
+        scaled_prev_values_total = scaler.fit_transform(prev_values_total.reshape(-1, 1))
+        x_pred_total = scaled_prev_values_total[-(seq_length-1):].reshape(1, (seq_length-1), 1)
+        predicted_value_total = model.predict(x_pred_total, verbose=0)
+        predicted_value_total = scaler.inverse_transform(predicted_value_total)
+        forecast_values_total.append(predicted_value_total[0][0])
+        prev_values_total = np.append(prev_values_total, predicted_value_total)
+        prev_values_total = prev_values_total[1:]
+    return np.array(forecast_values_total)
+
+
+def benchmark_forecast_engine(model_name="BE_v1.h5", repeat=3):
+    """Compares the legacy `predict` loop with the forecast engine for a model in the 'model' folder"""
+    from tensorflow.keras.models import load_model
+    import predictionModel as ml
+    from forecastEngine import ForecastEngine, compile_model
+    seq_length = ml.get_model_metadata(model_name)["input_sequence"]
+    model = load_model("./models/"+model_name, compile=False)
+    values = synthetic_percent_renewable(seq_length)
+    engine = ForecastEngine(compile_model(model, seq_length), seq_length)
+    # warm up : the first call traces the tf.function
+    expected = legacy_forecast(model, values, seq_length)
+    actual = engine.forecast(values)
+    result = {
+        "model": model_name,
+        "legacy": time_it(lambda: legacy_forecast(model, values, seq_length), repeat),
+        "engine": time_it(lambda: engine.forecast(values), repeat),
+        "max_abs_diff": float(np.max(np.abs(expected - actual))),
+        "same_rounded_output": bool(np.array_equal(expected.round(), actual.round())),
+    }
+    result["speedup"] = result["legacy"]["best"] / result["engine"]["best"]
+    print(result)
+    return result
+
+
+def benchmark_grouped_inference(copies=(1, 4, 10), repeat=3):
+    """Compares running one forecast engine per country with running the countries grouped by architecture.
+    The models in the 'model' folder are repeated `copies` times to simulate a larger number of countries.
+    """
+    from tensorflow.keras.models import load_model
+    import predictionModel as ml
+    from forecastEngine import ForecastEngine, compile_model, compile_model_group, architecture_signature
+    loaded = []
+    for country in sorted(ml.get_available_country_list()):
+        model_name = ml.get_latest_model_name_for(country)
+        seq_length = ml.get_model_metadata(model_name)["input_sequence"]
+        loaded.append((load_model("./models/"+model_name, compile=False), seq_length))
+    results = []
+    for n in copies:
+        models = loaded * n
+        single = [(ForecastEngine(compile_model(m, s), s), synthetic_percent_renewable(s)) for m, s in models]
+        groups = {}
+        for m, s in models:
+            groups.setdefault(architecture_signature(m, s), []).append(m)
+        grouped = [(ForecastEngine(compile_model_group(g, sig[0]), sig[0]),
+                    np.stack([synthetic_percent_renewable(sig[0])] * len(g))) for sig, g in groups.items()]
+        # warm up : the first call traces the tf.functions
+        for engine, values in single + grouped:
+            engine.forecast(values)
+        result = {
+            "countries": len(models),
+            "architectures": len(groups),
+            "per_country": time_it(lambda: [e.forecast(v) for e, v in single], repeat),
+            "grouped": time_it(lambda: [e.forecast(v) for e, v in grouped], repeat),
+        }
+        print(result)
+        results.append(result)
+    return results
+
+
+def benchmark_numpy_backend(copies=(1, 10), repeat=3):
+    """Checks that the NumPy backend (see `numpyModel.py`) gives the same forecasts as the Keras models of the 'model' folder
+    and compares their durations, for single models and for groups of models with the same architecture.
+    Reports the largest difference between the forecasts (in percentage points, before rounding) and the number of rounded values that differ.
+    """
+    from tensorflow.keras.models import load_model
+    import predictionModel as ml
+    from forecastEngine import ForecastEngine, compile_model, compile_model_group, architecture_signature
+    from numpyModel import NumpyModel
+    loaded = []
+    for country in sorted(ml.get_available_country_list()):
+        model_name = ml.get_latest_model_name_for(country)
+        seq_length = ml.get_model_metadata(model_name)["input_sequence"]
+        model = load_model("./models/"+model_name, compile=False)
+        loaded.append((model, NumpyModel.from_keras(model), seq_length))
+    parity = {"max_difference": 0.0, "rounded_differences": 0, "forecasts": 0}
+    for seed in range(10):
+        for model, numpy_model, seq_length in loaded:
+            values = synthetic_percent_renewable(seq_length, seed)
+            expected = ForecastEngine(compile_model(model, seq_length), seq_length).forecast(values)
+            actual = ForecastEngine(numpy_model, seq_length).forecast(values)
+            parity["max_difference"] = max(parity["max_difference"], float(np.abs(actual - expected).max()))
+            parity["rounded_differences"] += int((np.rint(actual) != np.rint(expected)).sum())
+            parity["forecasts"] += 1
+    print(parity)
+    results = [parity]
+    for n in copies:
+        models = loaded * n
+        groups = {}
+        for model, numpy_model, seq_length in models:
+            groups.setdefault(architecture_signature(model, seq_length), []).append((model, numpy_model))
+        engines = {
+            "keras": [(ForecastEngine(compile_model(m, s), s), synthetic_percent_renewable(s)) for m, _, s in models],
+            "numpy": [(ForecastEngine(nm, s), synthetic_percent_renewable(s)) for _, nm, s in models],
+            "keras_grouped": [(ForecastEngine(compile_model_group([m for m, _ in g], sig[0]), sig[0]),
+                               np.stack([synthetic_percent_renewable(sig[0])] * len(g))) for sig, g in groups.items()],
+            "numpy_grouped": [(ForecastEngine(NumpyModel.stack([nm for _, nm in g]), sig[0]),
+                               np.stack([synthetic_percent_renewable(sig[0])] * len(g))) for sig, g in groups.items()],
+        }
+        # warm up : the first call traces the tf.functions
+        for pairs in engines.values():
+            for engine, values in pairs:
+                engine.forecast(values)
+        result = {"countries": len(models)}
+        for name, pairs in engines.items():
+            result[name] = time_it(lambda: [e.forecast(v) for e, v in pairs], repeat)
+        print(result)
+        results.append(result)
+    return results
+
+
+def benchmark_rolling_scaler(seq_length=60, steps=48, repeat=20):
+    """Compares the scaling part of the forecast loop : refitting a StandardScaler on the window at every step
+    (with `np.append` and slicing) against the `RollingScaler`. The model is replaced by a stub that returns
+    the last scaled value, so only the scaling and the window handling are measured.
+    Reports the duration and the peak memory allocated during one forecast (measured with tracemalloc).
+    """
+    import tracemalloc
+    from sklearn.preprocessing import StandardScaler
+    from forecastEngine import RollingScaler
+    values = synthetic_percent_renewable(seq_length)
+
+    def legacy():
+        scaler = StandardScaler()
+        prev_values_total = values.copy()
+        for _ in range(steps):
+            scaled_prev_values_total = scaler.fit_transform(prev_values_total.reshape(-1, 1))
+            x_pred_total = scaled_prev_values_total[-(seq_length-1):].reshape(1, (seq_length-1), 1)
+            predicted_value_total = scaler.inverse_transform(x_pred_total[:, -1, :])
+            prev_values_total = np.append(prev_values_total, predicted_value_total)
+            prev_values_total = prev_values_total[1:]
+
+    scaler = RollingScaler(1, seq_length)
+    scaled = np.empty((1, seq_length))
+    model_input = np.empty((1, seq_length - 1, 1), dtype=np.float32)
+
+    def rolling():
+        scaler.fit(values.reshape(1, -1))
+        for _ in range(steps):
+            scaler.transform(out=scaled)
+            model_input[:, :, 0] = scaled[:, 1:]
+            scaler.push(scaler.inverse_transform(scaled[:, -1]))
+
+    def peak_memory(func):
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    result = {
+        "legacy": time_it(legacy, repeat),
+        "rolling": time_it(rolling, repeat),
+        "legacy_peak_bytes": peak_memory(legacy),
+        "rolling_peak_bytes": peak_memory(rolling),
+    }
+    print(result)
+    return result
+
+
+def synthetic_generation(days=3, freq_min=15, gaps=0, columns=10, tz="Europe/Berlin", seed=0):
+    """Returns a synthetic actual generation DataFrame (one column per production type) with a local time zone index.
+    `gaps` random rows (never the first or the last one) are removed to simulate missing values.
+    """
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2023-09-01", periods=days * 24 * 60 // freq_min, freq=f"{freq_min}min", tz=tz)
+    data = pd.DataFrame(rng.uniform(0, 1000, (len(index), columns)).round(), index=index,
+                        columns=[f"Source {i}" for i in range(columns)])
+    if gaps:
+        drop = rng.choice(np.arange(1, len(index) - 1), size=gaps, replace=False)
+        data = data.drop(index[drop])
+    return data
+
+
+def legacy_refine_data(options, data1):
+    """The gap filling of `entsoeAPI.refine_data` before it was vectorized (one filter and one concat per missing row)"""
+    import pandas as pd
+    durationMin = (data1.index[1] - data1.index[0]).total_seconds() / 60
+    refine_logs = []
+    expected_df = pd.DataFrame(index=pd.date_range(
+        start=data1.index.min(), end=data1.index.max(), freq=pd.Timedelta(minutes=durationMin)))
+    missing_indices = expected_df.index.difference(data1.index)
+    totalAverageValue = data1.mean().fillna(0).round().astype(int)
+    for index in missing_indices:
+        rows_same_day = data1[data1.index.date == index.date()]
+        if len(rows_same_day) > 0:
+            avg_val = rows_same_day.mean().fillna(0).round().astype(int)
+            avg_type = "average day value " + str(rows_same_day.index[0].date())+" "
+        else:
+            avg_val = totalAverageValue
+            avg_type = "whole data average "
+        refine_logs.append("Missing value: "+str(index) + "      replaced with " +
+                           avg_type + " : "+' '.join(avg_val.astype(str)))
+        new_row = pd.DataFrame([avg_val], columns=data1.columns, index=[index])
+        data1 = pd.concat([data1, new_row])
+    data1['startTimeUTC'] = (data1.index.tz_convert('UTC')).strftime('%Y%m%d%H%M')
+    data1.sort_index(inplace=True)
+    return {"data": data1, "refine_logs": refine_logs}
+
+
+def benchmark_refine_data(cases=((3, 15, 20), (30, 15, 500), (90, 15, 2000)), repeat=3):
+    """Compares the legacy gap filling with `entsoeAPI.refine_data` on synthetic frames (days, interval in minutes, number of gaps)"""
+    import entsoeAPI as en
+    results = []
+    for days, freq_min, gaps in cases:
+        data = synthetic_generation(days, freq_min, gaps)
+        expected = legacy_refine_data({}, data.copy())["data"]
+        actual = en.refine_data({}, data.copy())["data"]
+        result = {
+            "days": days, "interval": freq_min, "gaps": gaps,
+            "legacy": time_it(lambda: legacy_refine_data({}, data.copy()), repeat),
+            "vectorized": time_it(lambda: en.refine_data({}, data.copy()), repeat),
+            "same_index": bool(expected.index.tz_convert("UTC").equals(actual.index)),
+            # day averages can differ slightly since the legacy version included previously filled rows in the average
+            "max_abs_diff": float((expected.drop(columns="startTimeUTC").tz_convert("UTC") - actual).abs().max().max()),
+        }
+        print(result)
+        results.append(result)
+    return results
+
+
+def legacy_convert_to_60min_interval(rawData):
+    """`entsoeAPI.convert_to_60min_interval` before resampling on the datetime index : rows are grouped by position
+    and the 'startTimeUTC' strings are parsed back into datetimes"""
+    import pandas as pd
+    groupingFactor = int(60/rawData["duration"])
+    oldData = rawData["data"]
+    oldData["startTimeUTC"] = pd.to_datetime(oldData['startTimeUTC'])
+    start_time = oldData["startTimeUTC"].min()
+    end_time = oldData["startTimeUTC"].max()
+    oldData = oldData.drop(['startTimeUTC'], axis=1)
+    oldData['group_id'] = oldData.index // groupingFactor
+    newGroupedData = oldData.groupby('group_id').mean()
+    new_timestamps = pd.date_range(start=start_time, end=end_time, freq="60min", tz='UTC')
+    newGroupedData["startTimeUTC"] = new_timestamps.strftime('%Y%m%d%H%M')
+    return newGroupedData
+
+
+def benchmark_resample(days=(3, 365, 3650), repeat=3):
+    """Compares the legacy conversion to 60 minute intervals (which needs string timestamps and a positional index)
+    with `entsoeAPI.convert_to_60min_interval` on synthetic 15 minute data of up to ~350000 rows"""
+    import entsoeAPI as en
+    results = []
+    for n_days in days:
+        data = synthetic_generation(n_days, 15, 0).tz_convert("UTC")
+        legacy_input = en.add_start_time_utc(data.copy()).reset_index(drop=True)
+        result = {
+            "rows": len(data),
+            "legacy": time_it(lambda: legacy_convert_to_60min_interval({"data": legacy_input.copy(), "duration": 15}), repeat),
+            # the legacy version also needed the string timestamps of every row, created by refine_data
+            "legacy_with_strings": time_it(lambda: legacy_convert_to_60min_interval(
+                {"data": en.add_start_time_utc(data.copy()).reset_index(drop=True), "duration": 15}), repeat),
+            "resample": time_it(lambda: en.convert_to_60min_interval({"data": data, "duration": 15}), repeat),
+        }
+        print(result)
+        results.append(result)
+    return results
+
+
+def benchmark_import_time(modules=("savePredictions", "predictionModel", "backfill", "tensorflow"), repeat=3):
+    """Measures the import time of the entry points in a fresh interpreter with `python -X importtime`.
+    Importing the entry points should not load TensorFlow or the ENTSOE client (they are imported when models are run),
+    tensorflow is measured for reference"""
+    import subprocess
+    results = {}
+    for module in modules:
+        durations = []
+        for _ in range(repeat):
+            script = f"import sys, {module}; print(sorted(m for m in ('tensorflow', 'entsoe', 'sklearn') if m in sys.modules))"
+            process = subprocess.run([sys.executable, "-X", "importtime", "-c", script], capture_output=True, text=True, check=True)
+            # each line of stderr is "import time: self [us] | cumulative | module", the top level module comes last
+            lines = [line for line in process.stderr.splitlines() if line.startswith("import time:") and line.endswith(" " + module)]
+            durations.append(int(lines[-1].split("|")[1]) / 1e6)
+        results[module] = {"best": min(durations), "mean": sum(durations) / len(durations), "heavy_imports": process.stdout.strip()}
+        print(module, results[module])
+    return results
+
+
+def benchmark_entsoe(resolutions=(15, 30, 60), gaps=(0, 50), days=7, repeat=3):
+    """Times `entsoeAPI.refine_data` and `entsoeAPI.get_actual_percent_renewable` (download, refining and conversion to
+    60 minute intervals) with the fake ENTSOE client (see `benchmarkFixtures.py`), for each resolution and number of gaps"""
+    import pandas as pd
+    import entsoeAPI as en
+    from benchmarkFixtures import FakeEntsoeClient
+    end = pd.Timestamp("2023-09-01", tz="UTC")
+    start = end - pd.Timedelta(days=days)
+    previous = en.get_client, os.environ.get("PREDICTIONS_GENERATION_CACHE")
+    os.environ["PREDICTIONS_GENERATION_CACHE"] = "0"
+    results = []
+    try:
+        for freq_min in resolutions:
+            for n_gaps in gaps:
+                client = FakeEntsoeClient(freq_min, n_gaps)
+                en.get_client = lambda: client
+                raw = client.query_generation("BE", start, end)
+                raw.columns = [column[0] for column in raw.columns]
+                result = {
+                    "interval": freq_min, "gaps": n_gaps, "rows": len(raw),
+                    "refine_data": time_it(lambda: en.refine_data({}, raw.copy()), repeat),
+                    "get_actual_percent_renewable": time_it(lambda: en.get_actual_percent_renewable(
+                        "BE", start.strftime('%Y%m%d%H%M'), end.strftime('%Y%m%d%H%M'), True), repeat),
+                }
+                print(result)
+                results.append(result)
+    finally:
+        en.get_client = previous[0]
+        if previous[1] is None:
+            os.environ.pop("PREDICTIONS_GENERATION_CACHE")
+        else:
+            os.environ["PREDICTIONS_GENERATION_CACHE"] = previous[1]
+    return results
+
+
+def legacy_percent_renewable(table):
+    """The computation of `entsoeAPI.get_actual_percent_renewable` before it was vectorized (column-wise pandas operations)"""
+    import entsoeAPI as en
+    columns = set(table.columns)
+    table["renewableTotal"] = table[list(columns.intersection(en.renewableSources))].sum(axis=1)
+    table["renewableTotalWS"] = table[list(columns.intersection(en.windSolarOnly))].sum(axis=1)
+    table["nonRenewableTotal"] = table[list(columns.intersection(en.nonRenewableSources))].sum(axis=1)
+    table["total"] = table["nonRenewableTotal"] + table["renewableTotal"]
+    table["percentRenewable"] = ((table["renewableTotal"] / table["total"]) * 100).fillna(0).round().astype(int)
+    table["percentRenewableWS"] = ((table["renewableTotalWS"] / table["total"]) * 100).fillna(0).round().astype(int)
+    return table
+
+
+def benchmark_percent_renewable(countries=(1, 10, 50), days=30, repeat=3):
+    """Compares computing the percentage of renewable energy country by country with pandas and for all the countries at once
+    with `entsoeAPI.stack_generation` and `entsoeAPI.compute_percent_renewable`, on synthetic hourly generation data"""
+    import pandas as pd
+    import entsoeAPI as en
+    from benchmarkFixtures import FakeEntsoeClient, get_country_codes
+    client = FakeEntsoeClient(freq_min=60)
+    start = pd.Timestamp("2023-09-01", tz="UTC")
+    end = start + pd.Timedelta(days=days)
+    results = []
+    for count in countries:
+        tables = {}
+        for country in get_country_codes(count):
+            table = client.query_generation(country, start, end)
+            table.columns = [column[0] for column in table.columns]
+            tables[country] = table.T.groupby(level=0).sum().T.tz_convert("UTC")
+
+        def batch():
+            values, _, _ = en.stack_generation(tables)
+            return en.compute_percent_renewable(values, en.get_source_masks(tuple(en.sourceTypes)))
+        result = {
+            "countries": count, "hours": len(next(iter(tables.values()))),
+            "legacy": time_it(lambda: [legacy_percent_renewable(table.copy()) for table in tables.values()], repeat),
+            "batch": time_it(batch, repeat),
+        }
+        print(result)
+        results.append(result)
+    return results
+
+
+def benchmark_run_model(backends=("numpy", "keras"), input_sequences=(24, 60), repeat=5):
+    """Times `predictionModel.run_model` with synthetic models (see `benchmarkFixtures.py`) : the first call,
+    which loads the model, and the following calls"""
+    import predictionModel as ml
+    from benchmarkFixtures import benchmark_workspace
+    results = []
+    for backend in backends:
+        for input_sequence in input_sequences:
+            with benchmark_workspace(["X00"], numpy_backend=backend == "numpy", input_sequence=input_sequence):
+                model_input = ml.get_latest_model_input("X00")
+                start = time.perf_counter()
+                ml.run_model(model_input["model"], model_input["input_data"])
+                result = {
+                    "backend": backend, "input_sequence": input_sequence,
+                    "first_call": time.perf_counter() - start,
+                    "run_model": time_it(lambda: ml.run_model(model_input["model"], model_input["input_data"]), repeat),
+                }
+            print(result)
+            results.append(result)
+    return results
+
+
+def benchmark_main(countries=(1, 10, 50), backend="numpy", batched=False, latency=0.0):
+    """Times complete runs of `savePredictions.main` for an increasing number of countries, with the fake ENTSOE client,
+    an in-memory Redis and synthetic models (see `benchmarkFixtures.py`). The first run downloads all the input data and
+    loads the models, the second run uses the generation cache and the loaded models.
+    :param latency : seconds waited by each ENTSOE query, to simulate the network
+    """
+    import savePredictions as sp
+    from benchmarkFixtures import benchmark_workspace, get_country_codes, FakeEntsoeClient
+    results = []
+    for count in countries:
+        client = FakeEntsoeClient(latency=latency)
+        with benchmark_workspace(get_country_codes(count), client, numpy_backend=backend == "numpy") as redis_client:
+            runs = []
+            for _ in range(2):
+                start = time.perf_counter()
+                sp.main(batched=batched)
+                runs.append(time.perf_counter() - start)
+            result = {"countries": count, "backend": backend, "batched": batched, "first_run": runs[0], "second_run": runs[1],
+                      "entsoe_queries": client.calls, "redis_keys": len(redis_client.values)}
+        print(result)
+        results.append(result)
+    return results
+
+
+def flatten_timings(results, prefix=""):
+    """Returns {path : best duration} for all the timings (dictionaries with a 'best' value) in the results of a benchmark"""
+    flat = {}
+    if isinstance(results, dict) and "best" in results:
+        flat[prefix] = results["best"]
+    elif isinstance(results, dict):
+        for key, value in results.items():
+            flat.update(flatten_timings(value, f"{prefix}/{key}" if prefix else str(key)))
+    elif isinstance(results, list):
+        for i, value in enumerate(results):
+            flat.update(flatten_timings(value, f"{prefix}[{i}]"))
+    elif isinstance(results, float) and "run" in prefix.rsplit("/", 1)[-1]:
+        # single durations, e.g. the first and the second run of benchmark_main
+        flat[prefix] = results
+    return flat
+
+
+def record_results(name, results, folder_path="./data/benchmarks", threshold=1.2):
+    """Appends the results of a benchmark to `<folder_path>/<name>.jsonl` with the date and the git commit,
+    and prints the timings that are more than `threshold` times slower than in the previous record"""
+    import json
+    import subprocess
+    import platform
+    from datetime import datetime
+    os.makedirs(folder_path, exist_ok=True)
+    file_path = os.path.join(folder_path, name + ".jsonl")
+    previous = None
+    if os.path.exists(file_path):
+        with open(file_path, "r") as file:
+            lines = [line for line in file if line.strip()]
+        if lines:
+            previous = json.loads(lines[-1])
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    record = {"time": datetime.now().isoformat(), "commit": commit, "python": platform.python_version(), "results": results}
+    with open(file_path, "a") as file:
+        file.write(json.dumps(record, default=str) + "\n")
+    print("Results recorded in " + file_path)
+    if previous is not None:
+        old = flatten_timings(previous["results"])
+        for path, duration in flatten_timings(results).items():
+            if path in old and old[path] > 0 and duration > threshold * old[path]:
+                print(f"Regression : {path} {duration:.4f}s (was {old[path]:.4f}s at commit {previous['commit']})")
+
+
+benchmarks = {
+    "forecast_engine": benchmark_forecast_engine,
+    "grouped_inference": benchmark_grouped_inference,
+    "numpy_backend": benchmark_numpy_backend,
+    "rolling_scaler": benchmark_rolling_scaler,
+    "refine_data": benchmark_refine_data,
+    "resample": benchmark_resample,
+    "import_time": benchmark_import_time,
+    "entsoe": benchmark_entsoe,
+    "percent_renewable": benchmark_percent_renewable,
+    "run_model": benchmark_run_model,
+    "main": benchmark_main,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print("Available benchmarks : " + ", ".join(benchmarks))
+        print("Add --record to save the results in data/benchmarks and compare them with the previous record")
+    else:
+        results = benchmarks[sys.argv[1]]()
+        if "--record" in sys.argv[2:]:
+            record_results(sys.argv[1], results)
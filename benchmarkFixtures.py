@@ -0,0 +1,242 @@
+"""
+This file contains the stand-ins used by `benchmark.py` to run the prediction tool without the ENTSOE portal and the Redis server :
+- `FakeEntsoeClient` : returns synthetic generation data at a 15, 30 or 60 minute resolution with a controllable number of gaps
+- `InMemoryRedis` : the subset of the Redis client used by `redisWriter.py`, storing values in a dictionary
+- `create_synthetic_models` : small random Keras models (with their metadata and NumPy weight files) for any number of countries
+- `benchmark_workspace` : runs the tool in a temporary folder with the stand-ins above
+
+All the data is generated from seeds, so that benchmark runs are reproducible.
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+generation_types = ["Biomass", "Fossil Gas", "Fossil Hard coal", "Hydro Run-of-river and poundage", "Nuclear",
+                    "Other", "Solar", "Waste", "Wind Offshore", "Wind Onshore"]
+
+
+class FakeEntsoeClient:
+    """Stand-in for `entsoe.EntsoePandasClient` returning synthetic data
+    :param freq_min : resolution of the data in minutes
+    :param gaps : number of rows removed at random from each response (never the first or the last one)
+    :param tz : time zone of the returned index, like the ENTSOE client which returns data in the time zone of the country
+    :param latency : seconds waited by each query, to simulate the network
+    :param seed : seed of the random values, combined with the country code
+    """
+
+    def __init__(self, freq_min=15, gaps=0, tz="Europe/Brussels", latency=0.0, seed=0):
+        self.freq_min = freq_min
+        self.gaps = gaps
+        self.tz = tz
+        self.latency = latency
+        self.seed = seed
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _index(self, country, start, end):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        index = pd.date_range(start.ceil(f"{self.freq_min}min"), end, freq=f"{self.freq_min}min", inclusive="left")
+        if len(index) == 0:
+            from entsoe.exceptions import NoMatchingDataError
+            raise NoMatchingDataError
+        rng = np.random.default_rng([self.seed, zlib.crc32(country.encode()), int(start.timestamp())])
+        return index.tz_convert(self.tz), rng
+
+    def _drop_gaps(self, data, rng):
+        if self.gaps and len(data) > 2:
+            drop = rng.choice(np.arange(1, len(data) - 1), size=min(self.gaps, len(data) - 2), replace=False)
+            data = data.drop(data.index[drop])
+        return data
+
+    @staticmethod
+    def _values(index, rng, columns):
+        """Returns synthetic values : solar follows the daily cycle, wind varies slowly and other types are constant plus noise"""
+        hours = index.hour.to_numpy() + index.minute.to_numpy() / 60
+        values = {}
+        for column in columns:
+            if column == "Solar":
+                values[column] = np.maximum(0, np.sin((hours - 6) / 12 * np.pi)) * 3000
+            elif column.startswith("Wind"):
+                values[column] = 1500 + 1000 * np.sin(index.asi8 / 3.6e12 / 17 + rng.uniform(0, 6))
+            else:
+                values[column] = np.full(len(index), rng.uniform(100, 2000))
+            values[column] = np.maximum(0, values[column] + rng.normal(0, 50, len(index))).round()
+        return values
+
+    def query_generation(self, country_code, start, end, psr_type=None):
+        index, rng = self._index(country_code, start, end)
+        values = self._values(index, rng, generation_types)
+        columns = [(column, "Actual Aggregated") for column in generation_types]
+        data = pd.DataFrame(np.column_stack([values[c] for c in generation_types] + [np.zeros(len(index))]), index=index,
+                            columns=pd.MultiIndex.from_tuples(columns + [("Hydro Pumped Storage", "Actual Consumption")]))
+        return self._drop_gaps(data, rng)
+
+    def query_generation_forecast(self, country_code, start, end):
+        index, rng = self._index(country_code, start, end)
+        values = self._values(index, rng, generation_types)
+        return self._drop_gaps(pd.Series(np.sum(list(values.values()), axis=0), index=index), rng)
+
+    def query_wind_and_solar_forecast(self, country_code, start, end, psr_type=None):
+        index, rng = self._index(country_code, start, end)
+        columns = ["Solar", "Wind Onshore"]
+        return self._drop_gaps(pd.DataFrame(self._values(index, rng, columns), index=index), rng)
+
+
+class InMemoryRedis:
+    """Stand-in for the Redis client with the commands used by `redisWriter.RedisWriter`"""
+
+    def __init__(self):
+        self.values = {}
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def ping(self):
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self.values[key] = value
+        return True
+
+    def incr(self, key):
+        with self._lock:
+            self.values[key] = int(self.values.get(key, 0)) + 1
+            return self.values[key]
+
+    def publish(self, channel, message):
+        with self._lock:
+            self.messages.append((channel, message))
+        return 0
+
+    def pipeline(self, transaction=True):
+        return InMemoryPipeline(self)
+
+
+class InMemoryPipeline:
+    """Queues the commands and runs them together in `execute`, like a Redis MULTI/EXEC transaction"""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.commands = []
+
+    def set(self, *args, **kwargs):
+        self.commands.append((self.client.set, args, kwargs))
+
+    def incr(self, *args):
+        self.commands.append((self.client.incr, args, {}))
+
+    def execute(self):
+        results = [command(*args, **kwargs) for command, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+def create_synthetic_models(folder_path, countries, input_sequence=24, units=2, numpy_backend=True, seed=0):
+    """Creates a small random model (Bidirectional LSTM followed by a Dense layer, like the models of the 'model' folder)
+    for each country, with the metadata.json file. The countries share the same weights.
+    :param numpy_backend : also export the NumPy weight files (see `numpyModel.py`), so that the models run without TensorFlow
+    """
+    import tensorflow as tf
+    from numpyModel import NumpyModel, get_npz_path, get_file_hash
+    tf.keras.utils.set_random_seed(seed)
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(input_sequence - 1, 1)),
+        tf.keras.layers.Bidirectional(tf.keras.layers.LSTM(units)),
+        tf.keras.layers.Dense(1),
+    ])
+    os.makedirs(folder_path, exist_ok=True)
+    template = os.path.join(folder_path, "template.h5")
+    model.save(template)
+    numpy_model = NumpyModel.from_keras(model) if numpy_backend else None
+    metadata = []
+    for country in countries:
+        name = f"{country}_v1.h5"
+        file_path = os.path.join(folder_path, name)
+        shutil.copyfile(template, file_path)
+        if numpy_model is not None:
+            numpy_model.source_hash = get_file_hash(file_path)
+            numpy_model.save(get_npz_path(file_path))
+        metadata.append({"name": name, "country": country, "input_sequence": input_sequence, "description": "Synthetic model"})
+    os.remove(template)
+    with open(os.path.join(folder_path, "metadata.json"), "w") as file:
+        json.dump({"models": metadata}, file, indent=2)
+
+
+def get_country_codes(count):
+    """Returns `count` distinct synthetic country codes"""
+    return [f"X{i:02d}" for i in range(count)]
+
+
+@contextmanager
+def benchmark_workspace(countries, client=None, numpy_backend=True, input_sequence=24, forecast_cache=False):
+    """Runs the tool in a new temporary folder containing synthetic models for the countries.
+    The ENTSOE client is replaced by `client` (a `FakeEntsoeClient` by default) and Redis by an `InMemoryRedis`.
+    The forecast cache (see `forecastCache.py`) is disabled unless `forecast_cache` is True, so that repeated runs measure the inference.
+    The working directory, the environment and the replaced objects are restored at the end.
+    Yields the `InMemoryRedis` instance.
+    """
+    import entsoeAPI as en
+    import predictionModel as ml
+    import savePredictions as sp
+    from modelRegistry import ModelRegistry
+    from predictionStore import PredictionStore
+    from generationCache import GenerationCache
+    from redisWriter import RedisWriter
+    from forecastCache import ForecastCache
+    from accuracyTracker import AccuracyTracker
+    client = client or FakeEntsoeClient()
+    redis_client = InMemoryRedis()
+    previous_directory = os.getcwd()
+    previous_environment = dict(os.environ)
+    previous = (en.get_client, en.generation_cache, ml.registry, ml.forecast_cache, ml.accuracy_tracker, sp.predictionStore,
+                sp.redisWriter)
+    folder_path = tempfile.mkdtemp(prefix="predictions-benchmark-")
+    # the modules of the tool must stay importable from the temporary folder
+    source_path = os.path.dirname(os.path.abspath(__file__))
+    if source_path not in sys.path:
+        sys.path.insert(0, source_path)
+    try:
+        os.chdir(folder_path)
+        os.environ["ENTSOE_TOKEN"] = "benchmark"
+        os.environ["PREDICTIONS_MODEL_BACKEND"] = "numpy" if numpy_backend else "keras"
+        create_synthetic_models("./models", countries, input_sequence, numpy_backend=numpy_backend)
+        en.get_client = lambda: client
+        en.generation_cache = GenerationCache()
+        ml.registry = ModelRegistry("./models")
+        ml.forecast_cache = ForecastCache(mode=None if forecast_cache else "none")
+        ml.accuracy_tracker = AccuracyTracker()
+        sp.predictionStore = PredictionStore()
+        sp.redisWriter = RedisWriter()
+        sp.redisWriter.get_client = lambda: redis_client
+        yield redis_client
+    finally:
+        en.get_client, en.generation_cache, ml.registry, ml.forecast_cache, ml.accuracy_tracker, sp.predictionStore, \
+            sp.redisWriter = previous
+        os.chdir(previous_directory)
+        os.environ.clear()
+        os.environ.update(previous_environment)
+        shutil.rmtree(folder_path, ignore_errors=True)
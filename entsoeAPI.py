@@ -1,8 +1,29 @@
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
 import time
-from entsoe import EntsoePandasClient as entsoePandas
 import os
+import threading
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import Future
+from generationCache import GenerationCache
+from metrics import metrics
+
+_client = None
+_client_lock = threading.Lock()
+generation_cache = GenerationCache()
+# (endpoint, country, start, end, arguments) -> Future of the query result, while a query scope is active (see query_scope)
+_query_cache = None
+_query_scope_depth = 0
+_query_cache_lock = threading.Lock()
+
+renewableSources = ["Geothermal", "Hydro Pumped Storage", "Hydro Run-of-river and poundage",
+                    "Hydro Water Reservoir", "Marine", "Other renewable", "Solar", "Waste", "Wind Offshore", "Wind Onshore"]
+windSolarOnly = ["Solar", "Wind Offshore", "Wind Onshore"]
+nonRenewableSources = ["Biomass", "Fossil Brown coal/Lignite", "Fossil Coal-derived gas", "Fossil Gas",
+                       "Fossil Hard coal", "Fossil Oil", "Fossil Oil shale", "Fossil Peal", "Nuclear", "Other"]
+# all the production types, in the order of the last axis of the arrays used by `compute_percent_renewable`
+sourceTypes = renewableSources + nonRenewableSources
 
 
 def get_API_token() -> str:
@@ -15,94 +36,253 @@ def get_API_token() -> str:
     return value
 
 
+def get_client():
+    """Returns the ENTSOE client shared by all requests (created at the first call)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            # imported here since the entsoe package is slow to import and only needed to download data
+            from entsoe import EntsoePandasClient as entsoePandas
+            _client = entsoePandas(api_key=get_API_token())
+        return _client
+
+
+@contextmanager
+def query_scope():
+    """Within the block, identical ENTSOE queries (same endpoint, country and time period) are downloaded only once,
+    even when they are made at the same time by several threads. The downloaded data is released at the end of the block.
+    Scopes can be nested : the data is kept until the outermost block ends.
+    """
+    global _query_cache, _query_scope_depth
+    with _query_cache_lock:
+        if _query_scope_depth == 0:
+            _query_cache = {}
+        _query_scope_depth += 1
+    try:
+        yield
+    finally:
+        with _query_cache_lock:
+            _query_scope_depth -= 1
+            if _query_scope_depth == 0:
+                _query_cache = None
+
+
+def query_entsoe(endpoint, country, start, end, **kwargs):
+    """Runs a query of the shared ENTSOE client. Inside a `query_scope`, the result is memoized and a copy is returned
+    :param endpoint : name of the method of the client, e.g. "query_generation"
+    :param start, end : pd.Timestamp
+    """
+    key = (endpoint, country, start, end, tuple(sorted(kwargs.items())))
+    with _query_cache_lock:
+        cache = _query_cache
+        owner = cache is not None and key not in cache
+        if owner:
+            cache[key] = Future()
+    if cache is not None and not owner:
+        # the query was made (or is being made) by another call in the same scope
+        data = cache[key].result()
+        metrics.record("entsoe_fetch", endpoint=endpoint, duration=0.0, rows=len(data), memoized=1)
+        return data.copy()
+    try:
+        with metrics.stage("entsoe_fetch", endpoint=endpoint, memoized=0) as stage:
+            data = getattr(get_client(), endpoint)(country, start=start, end=end, **kwargs)
+            stage["rows"] = len(data)
+    except Exception as e:
+        if owner:
+            cache[key].set_exception(e)
+        raise
+    if owner:
+        cache[key].set_result(data)
+        return data.copy()
+    return data
+
+
+@lru_cache(maxsize=None)
+def get_source_columns(columns) -> dict:
+    """Returns the columns of a generation table that are renewable, wind or solar, and non renewable sources, in the order of the table.
+    The result is computed once for each set of columns (i.e. once for each country)
+    :param columns : tuple of the column names of the table
+    """
+    return {
+        "renewable": [column for column in columns if column in renewableSources],
+        "windSolar": [column for column in columns if column in windSolarOnly],
+        "nonRenewable": [column for column in columns if column in nonRenewableSources],
+        "sources": [column for column in columns if column in sourceTypes],
+    }
+
+
+@lru_cache(maxsize=None)
+def get_source_masks(columns) -> np.ndarray:
+    """Returns the masks of the production types as a matrix of shape (number of columns, 3) : the columns of the matrix
+    are 1 for the renewable, the wind or solar and the non renewable production types respectively.
+    Multiplying generation values by this matrix gives the three totals in a single matrix product.
+    :param columns : tuple of production types
+    """
+    masks = np.array([[column in renewableSources, column in windSolarOnly, column in nonRenewableSources] for column in columns],
+                     dtype=np.float64)
+    return masks.reshape(len(columns), 3)
+
+
+def compute_percent_renewable(values, masks):
+    """Computes the percentage of renewable energy from generation values, for any number of leading dimensions (e.g. country and hour)
+    :param values : array of shape (..., production types). Missing values (NaN) count as 0
+    :param masks : matrix returned by `get_source_masks` for the production types of the last axis
+    :return (totals, percents) : totals is an array of shape (..., 4) with the renewable, the wind and solar, the non renewable and the total
+    generation, percents is an integer array of shape (..., 2) with the percentage of renewable and of wind and solar energy
+    (0 when the total is 0)
+    """
+    totals = np.empty(values.shape[:-1] + (4,), dtype=np.float64)
+    np.matmul(np.nan_to_num(values), masks, out=totals[..., :3])
+    np.add(totals[..., 0], totals[..., 2], out=totals[..., 3])
+    percents = np.zeros(values.shape[:-1] + (2,), dtype=np.float64)
+    np.divide(totals[..., :2], totals[..., 3:], out=percents, where=totals[..., 3:] != 0)
+    percents *= 100
+    return totals, np.rint(percents, out=percents).astype(int)
+
+
+def use_generation_cache() -> bool:
+    """Returns True unless the generation cache is disabled with the environment variable `PREDICTIONS_GENERATION_CACHE=0`"""
+    return os.environ.get("PREDICTIONS_GENERATION_CACHE", "1") != "0"
+
+
+def get_duration_min(index) -> float:
+    """Returns the duration (in minutes) of the time series : the most common interval between two consecutive timestamps.
+    Unlike the interval between the first two rows, this is not affected by a missing row at the beginning of the data
+    or by data published with different resolutions (e.g. 60 minute values followed by 15 minute values)
+    """
+    differences = index[1:] - index[:-1]
+    return pd.Series(differences).mode().iloc[0].total_seconds() / 60
+
+
+def get_missing_timestamps(index, durationMin, min_run=8) -> pd.DatetimeIndex:
+    """Returns the timestamps missing in the time series, on a grid of `durationMin` minutes between the first and the last timestamp.
+    A timestamp of the grid is missing if it is not covered by any row. A row covers `durationMin` minutes, except in
+    parts of the data published with a coarser resolution : a run of at least `min_run` identical intervals longer than `durationMin`
+    (e.g. 60 minute values for several hours in a series of 15 minute values) is considered as a change of resolution 
+    and not as missing rows.
+    """
+    base = int(pd.Timedelta(minutes=durationMin).value)
+    times = index.asi8
+    differences = np.diff(times)
+    covered = np.full(len(times), base, dtype=np.int64)
+    if len(differences) > 0:
+        # group consecutive identical intervals into runs
+        new_run = np.r_[True, differences[1:] != differences[:-1]]
+        run_id = np.cumsum(new_run) - 1
+        run_length = np.bincount(run_id)[run_id]
+        coarse = (differences > base) & (run_length >= min_run)
+        covered[:-1][coarse] = differences[coarse]
+    expected_timestamps = pd.date_range(start=index.min(), end=index.max(), freq=pd.Timedelta(minutes=durationMin))
+    # the row starting at or before each expected timestamp
+    row = np.searchsorted(times, expected_timestamps.asi8, side="right") - 1
+    missing = expected_timestamps.asi8 >= times[row] + covered[row]
+    return expected_timestamps[missing]
+
+
+def add_start_time_utc(data) -> pd.DataFrame:
+    """Adds the column `startTimeUTC` with the start time of each row in the 'YYYYMMDDhhmm' format (in UTC).
+    The data must have a timezone aware datetime index"""
+    data["startTimeUTC"] = data.index.tz_convert("UTC").strftime('%Y%m%d%H%M')
+    return data
+
+
 def refine_data(options, data1):
     """Returns a refined version of the dataframe. 
     The Refining process involves finding missing values and substituting them with average values. 
-    Additionally, a new column `startTimeUTC` is appended to the dataframe representing the start time in UTC  
+    The refined dataframe keeps the datetime index (converted to UTC). See `add_start_time_utc` to add the start time as a column.
     :param options 
     :param data1 : the dataframe that has to be refined. Assuming it has a datetime index in local time zone with country info
-    :returns {"data":Refined data frame, "refine_logs":["list of refinements made"]}
+    :returns {"data":Refined data frame, "refine_logs":["list of refinements made"], "imputed":DatetimeIndex (UTC) of the rows that were filled}
     """
 
-    # calculate the duration of the time series by finding the difference between the
-    # first and the second index (which is of the type `datatime``) and convert this into minutes
-    durationMin = (data1.index[1] - data1.index[0]).total_seconds() / 60
+    start = time.perf_counter()
+    fetched_rows = len(data1)
+    # calculate the duration of the time series (see get_duration_min)
+    durationMin = get_duration_min(data1.index)
     # initializing the log list
     refine_logs = []
     refine_logs.append("Row count : Fetched =  " +
                        str(len(data1)) + ", duration : "+str(durationMin))
     """
     Determining the list of records that are absent in the time series by initially creating a set containing all 
-    the expected timestamps within the start and end time range. Then, we calculate the difference between 
-    this set and the timestamps present in the actual DataFrame.
+    the expected timestamps within the start and end time range. Then, we find the expected timestamps that are not covered 
+    by the rows of the actual DataFrame (see get_missing_timestamps).
     """
-    start_time = data1.index.min()
-    end_time = data1.index.max()
-    expected_timestamps = pd.date_range(
-        start=start_time, end=end_time, freq=f"{durationMin}T")
-    expected_df = pd.DataFrame(index=expected_timestamps)
-    missing_indices = expected_df.index.difference(data1.index)
+    missing_indices = get_missing_timestamps(data1.index, durationMin)
     """ Next, we fill in the missing values. 
     For each absent timestamp, we examine if the entries for the same day exists. 
     If they do, we use the day average for each column in the Dataframe. 
-    Else, we use the average of the entire data
+    Else, we use the average of the entire data.
+    This is done for all the missing timestamps at once : the dataframe is reindexed to include them
+    and the day averages are computed with a single groupby over the (local) date of each row.
     """
-    totalAverageValue = data1.mean().fillna(0).round().astype(int)
-    for index in missing_indices:
-        rows_same_day = data1[data1.index.date == index.date()]
-        if len(rows_same_day) > 0:
-            avg_val = rows_same_day.mean().fillna(0).round().astype(int)
-            avg_type = "average day value " + \
-                str(rows_same_day.index[0].date())+" "
-        else:
-            avg_val = totalAverageValue
-            avg_type = "whole data average "
-        refine_logs.append("Missing value: "+str(index) + "      replaced with " +
-                           avg_type + " : "+' '.join(avg_val.astype(str)))
-        new_row = pd.DataFrame([avg_val], columns=data1.columns, index=[index])
-        data1 = pd.concat([data1, new_row])
-        # prev_index = index - dur
-        # next_index = index + dur
-        # avg_val = (data1.loc[prev_index]+data1.loc[next_index])/2
-        # new_row = pd.DataFrame([avg_val], columns=data1.columns, index=[index])
-        # data1 = pd.concat([data1, new_row])
+    if len(missing_indices) > 0:
+        totalAverageValue = data1.mean().fillna(0).round().astype(int)
+        data1 = data1.reindex(data1.index.union(missing_indices))
+        missing = data1.index.isin(missing_indices)
+        days = data1.index.normalize()
+        # day average and number of fetched rows of the day of each row
+        day_average = data1.groupby(days).transform("mean").fillna(0).round().astype(int)
+        day_count = pd.Series(~missing, index=data1.index).groupby(days).transform("sum")
+        has_day_rows = (day_count > 0).to_numpy()
+        fill_values = np.where(has_day_rows[:, None], day_average.to_numpy(), totalAverageValue.to_numpy()[None, :])
+        data1.loc[missing, :] = fill_values[missing]
+        # one log entry for each day with missing values
+        missing_days = pd.DataFrame({"time": data1.index[missing], "has_rows": has_day_rows[missing]},
+                                    index=days[missing]).groupby(level=0)
+        summary = missing_days.agg(first=("time", "first"), last=("time", "last"),
+                                   count=("time", "size"), has_rows=("has_rows", "first"))
+        for day, row in summary.iterrows():
+            if row["has_rows"]:
+                avg_val = day_average.loc[row["first"]]
+                avg_type = "average day value " + str(day.date())+" "
+            else:
+                avg_val = totalAverageValue
+                avg_type = "whole data average "
+            refine_logs.append("Missing values: "+str(row["count"]) + " between "+str(row["first"]) + " and " +
+                               str(row["last"]) + "      replaced with " + avg_type + " : "+' '.join(avg_val.astype(str)))
 
     """ Currently, the datatime index is set in the time zone of the data's country of origin. 
-    We convert it into UTC and add it as a new column named 'startTimeUTC' in the 'YYYYMMDDhhmm' format.
+    We convert it into UTC.
     """
-    data1['startTimeUTC'] = (data1.index.tz_convert('UTC')).strftime('%Y%m%d%H%M')
-    # data1['startTimeLocal'] = (data1.index).strftime('%Y%m%d%H%M')
-    # since missing values are concatenated to the dataframe, it is also sorted based on the datetime index
+    data1 = data1.tz_convert('UTC')
     data1.sort_index(inplace=True)
-    return {"data": data1, "refine_logs": refine_logs}
+    metrics.record("refine_data", duration=time.perf_counter() - start, rows=fetched_rows, gaps=len(missing_indices))
+    return {"data": data1, "refine_logs": refine_logs, "imputed": missing_indices.tz_convert('UTC')}
 
 
 def entsoe_get_actual_generation(options={"country": "", "start": "", "end": ""}):
     """Fetches the aggregated actual generation per production type data (16.1.B&C) for the given country within the given start and end date
     params: options = {country (2 letter country code),start,end} . Both the dates are in the YYYYMMDDhhmm format and the local time zone
-    returns : {"data":pd.DataFrame, "duration":duration (in min) of the time series data, "refine_logs":"notes on refinements made" }
+    Set options["use_cache"] to False to bypass the generation cache (the cache is neither read nor updated)
+    returns : {"data":pd.DataFrame, "duration":duration (in min) of the time series data, "refine_logs":"notes on refinements made",
+    "imputed":timestamps of the rows filled by `refine_data` }
     """
-    client1 = entsoePandas(api_key=get_API_token())
-    data1 = client1.query_generation(
-        options["country"],
-        start=pd.Timestamp(options["start"], tz='UTC'),
-        end=pd.Timestamp(options["end"], tz='UTC'),
-        psr_type=None)
-    # drop columns with actual consumption values (we want actual aggregated generation values)
-    columns_to_drop = [
-        col for col in data1.columns if col[1] == 'Actual Consumption']
-    data1 = data1.drop(columns=columns_to_drop)
-    # If certain column names are in the format of a tuple like (energy_type, 'Actual Aggregated'),
-    # these column names are transformed into strings using the value of energy_type.
-    data1.columns = [(col[0] if isinstance(col, tuple) else col)
-                     for col in data1.columns]
+    def fetch(start, end):
+        data1 = query_entsoe("query_generation", options["country"], start, end, psr_type=None)
+        # drop columns with actual consumption values (we want actual aggregated generation values)
+        columns_to_drop = [
+            col for col in data1.columns if col[1] == 'Actual Consumption']
+        data1 = data1.drop(columns=columns_to_drop)
+        # If certain column names are in the format of a tuple like (energy_type, 'Actual Aggregated'),
+        # these column names are transformed into strings using the value of energy_type.
+        data1.columns = [(col[0] if isinstance(col, tuple) else col)
+                         for col in data1.columns]
+        return data1
+
+    start = pd.Timestamp(options["start"], tz='UTC')
+    end = pd.Timestamp(options["end"], tz='UTC')
+    if options.get("use_cache", True) and use_generation_cache():
+        # only the hours after the last cached value are downloaded. see generationCache.py
+        data1 = generation_cache.get(options["country"], start, end, fetch)
+    else:
+        data1 = fetch(start, end)
     # refine the dataframe. see the refine method
     data2 = refine_data(options, data1)
     refined_data = data2["data"]
-    refined_data = refined_data.reset_index(drop=True)
     # finding the duration of the time series data
-    durationMin = (data1.index[1] - data1.index[0]).total_seconds() / 60
-    return {"data": refined_data, "duration": durationMin, "refine_logs": data2["refine_logs"]}
+    durationMin = get_duration_min(data1.index)
+    return {"data": refined_data, "duration": durationMin, "refine_logs": data2["refine_logs"], "imputed": data2["imputed"]}
 
 
 def entsoe_get_total_forecast(options={"country": "", "start": "", "end": ""}):
@@ -110,22 +290,18 @@ def entsoe_get_total_forecast(options={"country": "", "start": "", "end": ""}):
     params: options = {country (2 letter country code),start,end} . Both the dates are in the YYYYMMDDhhmm format and the local time zone
     returns : {"data":pd.DataFrame, "duration":duration (in min) of the time series data, "refine_logs":"notes on refinements made" }
     """
-    client = entsoePandas(api_key=get_API_token())
-    data = client.query_generation_forecast(
-        options["country"],
-        start=pd.Timestamp(options["start"], tz='UTC'),
-        end=pd.Timestamp(options["end"], tz='UTC'))
+    data = query_entsoe("query_generation_forecast", options["country"],
+                        pd.Timestamp(options["start"], tz='UTC'), pd.Timestamp(options["end"], tz='UTC'))
     # if the data is a series instead of a dataframe, it will be converted to a dataframe
     if isinstance(data, pd.Series):
         data = data.to_frame(name="Actual Aggregated")
-    durationMin = (data.index[1] - data.index[0]).total_seconds() / 60
+    durationMin = get_duration_min(data.index)
     # refining the data
     data2 = refine_data(options, data)
     refined_data = data2["data"]
     # rename the single column
     newCol = {'Actual Aggregated': 'total'}
     refined_data.rename(columns=newCol, inplace=True)
-    refined_data = refined_data.reset_index(drop=True)
     return {"data": refined_data, "duration": durationMin, "refine_logs": data2["refine_logs"]}
 
 
@@ -135,105 +311,110 @@ def entsoe_get_wind_solar_forecast(options={"country": "", "start": "", "end": "
     params: options = {country (2 letter country code),start,end} . Both the dates are in the YYYYMMDDhhmm format and the local time zone
     returns : {"data":pd.DataFrame, "duration":duration (in min) of the time series data, "refine_logs":"notes on refinements made" }
     """
-    client = entsoePandas(api_key=get_API_token())
-    data = client.query_wind_and_solar_forecast(
-        options["country"],
-        start=pd.Timestamp(options["start"], tz='UTC'),
-        end=pd.Timestamp(options["end"], tz='UTC'))
-    durationMin = (data.index[1] - data.index[0]).total_seconds() / 60
+    data = query_entsoe("query_wind_and_solar_forecast", options["country"],
+                        pd.Timestamp(options["start"], tz='UTC'), pd.Timestamp(options["end"], tz='UTC'))
+    durationMin = get_duration_min(data.index)
     # refining the data
     data2 = refine_data(options, data)
     refined_data = data2["data"]
     # calculating the total renewable consumption value
-    validCols = ["Solar", "Wind Offshore", "Wind Onshore"]
-    existingCol = []
-    for col in validCols:
-        if col in refined_data.columns:
-            existingCol.append(col)
+    existingCol = get_source_columns(tuple(refined_data.columns))["windSolar"]
     refined_data["totalRenewable"] = refined_data[existingCol].sum(axis=1)
-    refined_data = refined_data.reset_index(drop=True)
     return {"data": refined_data, "duration": durationMin, "refine_logs": data2["refine_logs"]}
 
 
 def convert_to_60min_interval(rawData):
     """Given the rawData obtained from the ENTSOE API methods, this function converts the DataFrame into 
-    60-minute time intervals by aggregating data from multiple rows. """
-    duration = rawData["duration"]
-    if duration == 60:
-        """ If the duration is already 60, return data """
-        return rawData["data"]
-    elif duration < 60:
-        """
-        First, we determine the number of rows needed to combine in order to obtain data in a 60-minute format. 
-        It is important to note that the rows are combined by taking the average of the row data, rather than the sum.
-        """
-        # determining how many rows need to be combined to get data in 60 min format.
-        groupingFactor = int(60/duration)
-        oldData = rawData["data"]
-        oldData["startTimeUTC"] = pd.to_datetime(oldData['startTimeUTC'])
-        start_time = oldData["startTimeUTC"] .min()
-        end_time = oldData["startTimeUTC"] .max()
-        durationMin = 60
-        # removing the old timestamps (which are not 60 mins apart)
-        dataColToRemove = ['startTimeUTC']
-        # dataColToRemove = ['startTimeUTC','startTimeLocal']
-        oldData = oldData.drop(dataColToRemove, axis=1)
-
-        oldData['group_id'] = oldData.index // groupingFactor
-        newGroupedData = oldData.groupby('group_id').mean()
-        # new timestamps which are 60 min apart 
-        new_timestamps = pd.date_range(
-            start=start_time, end=end_time, freq=f"{durationMin}T", tz='UTC')
-        new_timestamps = new_timestamps.strftime('%Y%m%d%H%M')
-        newGroupedData["startTimeUTC"] = new_timestamps
-        return newGroupedData
-
-
-def get_actual_percent_renewable(country, start, end, interval60=False) -> pd.DataFrame:
+    60-minute time intervals by aggregating data from multiple rows.
+    Rows are grouped by the hour (in UTC) in which they start, using the datetime index of the data. 
+    It is important to note that the rows are combined by taking the average of the row data, rather than the sum.
+    Since rows are grouped by their timestamps, data that does not start on the hour or that mixes 15, 30 and 60 minute 
+    intervals is aggregated correctly. Hours without any data are dropped.
+    """
+    with metrics.stage("resample") as stage:
+        data = rawData["data"]
+        hourly = data.resample("60min").mean().dropna(how="all")
+        stage.update(rows=len(data), hourly_rows=len(hourly))
+    return hourly
+
+
+def get_actual_percent_renewable(country, start, end, interval60=False, use_cache=True) -> pd.DataFrame:
     """Returns time series data containing the percentage of energy generated from renewable sources for the specified country within the selected time period. 
     The data is sourced from the ENTSOE APIs and subsequently refined. 
     To obtain data in 60-minute intervals (if not already available), set 'interval60' to True
+    The column 'imputed' is True for the rows (hours if 'interval60' is True) containing values filled by `refine_data`
+    Set 'use_cache' to False to download the data without reading or updating the generation cache (see `generationCache.py`)
     """
     options = {"country": country, "start": start,
-               "end": end, "interval60": interval60}
+               "end": end, "interval60": interval60, "use_cache": use_cache}
     # get actual generation data per production type and convert it into 60 min interval if required
     totalRaw = entsoe_get_actual_generation(options)
     total = totalRaw["data"]
-    duration = totalRaw["duration"]
-    if options["interval60"] == True and totalRaw["duration"] != 60.0:
+    if options["interval60"] == True:
         table = convert_to_60min_interval(totalRaw)
-        duration = 60
     else:
         table = total
     # print("actual total")
     # print(totalRaw["refine_logs"])
     # finding the percent renewable
-    renewableSources = ["Geothermal", "Hydro Pumped Storage", "Hydro Run-of-river and poundage",
-                        "Hydro Water Reservoir", "Marine", "Other renewable", "Solar", "Waste", "Wind Offshore", "Wind Onshore"]
-    windSolarOnly = ["Solar", "Wind Offshore", "Wind Onshore"]
-    nonRenewableSources = ["Biomass", "Fossil Brown coal/Lignite", "Fossil Coal-derived gas", "Fossil Gas",
-                           "Fossil Hard coal", "Fossil Oil", "Fossil Oil shale", "Fossil Peal", "Nuclear", "Other"]
-    allCols = table.columns.tolist()
     # find out which columns are present in the data out of all the possible columns in both the categories
-    renPresent = list(set(allCols).intersection(renewableSources))
-    renPresentWS = list(set(allCols).intersection(windSolarOnly))
-    nonRenPresent = list(set(allCols).intersection(nonRenewableSources))
-    # find total renewable, total non renewable and total energy values
-    table["renewableTotal"] = table[renPresent].sum(axis=1)
-    table["renewableTotalWS"] = table[renPresentWS].sum(axis=1)
-    table["nonRenewableTotal"] = table[nonRenPresent].sum(axis=1)
-    table["total"] = table["nonRenewableTotal"] + table["renewableTotal"]
-    # calculate percent renewable
-    table["percentRenewable"] = (
-        table["renewableTotal"] / table["total"]) * 100
-    # refine percentage values : replacing missing values with 0 and converting to integer
-    table['percentRenewable'].fillna(0, inplace=True)
-    table["percentRenewable"] = table["percentRenewable"].round().astype(int)
-    table["percentRenewableWS"] = (
-        table["renewableTotalWS"] / table["total"]) * 100
-    table['percentRenewableWS'].fillna(0, inplace=True)
-    table["percentRenewableWS"] = table["percentRenewableWS"].round().astype(int)
-    return table
+    sources = get_source_columns(tuple(table.columns))["sources"]
+    totals, percents = compute_percent_renewable(table[sources].to_numpy(dtype=np.float64), get_source_masks(tuple(sources)))
+    table["renewableTotal"] = totals[:, 0]
+    table["renewableTotalWS"] = totals[:, 1]
+    table["nonRenewableTotal"] = totals[:, 2]
+    table["total"] = totals[:, 3]
+    table["percentRenewable"] = percents[:, 0]
+    table["percentRenewableWS"] = percents[:, 1]
+    imputed = totalRaw["imputed"]
+    table["imputed"] = table.index.isin(imputed.floor("60min") if options["interval60"] == True else imputed)
+    return add_start_time_utc(table)
+
+
+def stack_generation(tables):
+    """Aligns the hourly generation data of several countries in a single array
+    :param tables : dictionary {country : generation DataFrame with a UTC datetime index and one column per production type}
+    :return (values, hours, available) : values is an array of shape (countries, hours, production types) in the order of `sourceTypes`
+    with NaN for missing data, hours is the DatetimeIndex of all the hours present in at least one table and available is a
+    boolean array of shape (countries, hours) which is True where the country has data for the hour
+    """
+    hours = pd.DatetimeIndex([], tz="UTC")
+    for table in tables.values():
+        hours = hours.union(table.index)
+    values = np.full((len(tables), len(hours), len(sourceTypes)), np.nan)
+    available = np.zeros((len(tables), len(hours)), dtype=bool)
+    for i, table in enumerate(tables.values()):
+        sources = get_source_columns(tuple(table.columns))["sources"]
+        rows = hours.get_indexer(table.index)
+        values[i, rows[:, None], [sourceTypes.index(source) for source in sources]] = table[sources].to_numpy(dtype=np.float64)
+        available[i, rows] = True
+    return values, hours, available
+
+
+def get_actual_percent_renewable_batch(countries, start, end) -> pd.DataFrame:
+    """Returns the hourly percentage of renewable energy of several countries. The generation data of the countries is stacked
+    in one array (see `stack_generation`) and the percentages of all the countries are computed together.
+    Countries for which the data cannot be fetched are left out.
+    :param start, end : time period ('YYYYMMDDhhmm' in UTC)
+    :return pd.DataFrame with the columns country, startTimeUTC, percentRenewable and percentRenewableWS, sorted by country and hour
+    """
+    tables = {}
+    with query_scope():
+        for country in countries:
+            try:
+                tables[country] = convert_to_60min_interval(
+                    entsoe_get_actual_generation({"country": country, "start": start, "end": end}))
+            except Exception as e:
+                print("Error in fetching data for "+country+" : "+repr(e))
+    values, hours, available = stack_generation(tables)
+    _, percents = compute_percent_renewable(values, get_source_masks(tuple(sourceTypes)))
+    country_index, hour_index = np.nonzero(available)
+    return pd.DataFrame({
+        "country": np.array(list(tables), dtype=object)[country_index],
+        "startTimeUTC": hours[hour_index].strftime('%Y%m%d%H%M'),
+        "percentRenewable": percents[country_index, hour_index, 0],
+        "percentRenewableWS": percents[country_index, hour_index, 1],
+    })
 
 
 def get_forecast_percent_renewable(country, start, end) -> pd.DataFrame:
@@ -243,16 +424,8 @@ def get_forecast_percent_renewable(country, start, end) -> pd.DataFrame:
     To obtain data in 60-minute intervals (if not already available), set 'interval60' to True"""
     options = {"country": country, "start": start,
                "end": end}
-    totalRaw = entsoe_get_total_forecast(options)
-    if totalRaw["duration"] != 60:
-        total = convert_to_60min_interval(totalRaw)
-    else:
-        total = totalRaw["data"]
-    windsolarRaw = entsoe_get_wind_solar_forecast(options)
-    if windsolarRaw["duration"] != 60:
-        windsolar = convert_to_60min_interval(windsolarRaw)
-    else:
-        windsolar = windsolarRaw["data"]
+    total = convert_to_60min_interval(entsoe_get_total_forecast(options))
+    windsolar = convert_to_60min_interval(entsoe_get_wind_solar_forecast(options))
     # print("wind solar forecast raw"); print(windsolarRaw["refine_logs"])
     # print("total forecast raw"); print(totalRaw["refine_logs"])
     windsolar["total"] = total["total"]
@@ -260,4 +433,23 @@ def get_forecast_percent_renewable(country, start, end) -> pd.DataFrame:
         windsolar['totalRenewable'] / windsolar['total']) * 100
     windsolar['percentRenewable'].fillna(0, inplace=True)
     windsolar["percentRenewable"] = windsolar["percentRenewable"].round().astype(int)
-    return windsolar
+    return add_start_time_utc(windsolar)
+
+
+def get_percent_renewable(countries, start, end, forecast_start=None, forecast_end=None) -> dict:
+    """Returns the actual and the forecast percentage of renewable energy of several countries in a single query scope (see `query_scope`),
+    so that each ENTSOE query is downloaded once even if the countries or the time periods repeat
+    :param start, end : time period of the actual data ('YYYYMMDDhhmm' in UTC)
+    :param forecast_start, forecast_end : time period of the forecast data (default : same as the actual data)
+    :return dictionary {country : {"actual" : DataFrame, "forecast" : DataFrame}}
+    """
+    forecast_start = forecast_start or start
+    forecast_end = forecast_end or end
+    results = {}
+    with query_scope():
+        for country in countries:
+            results[country] = {
+                "actual": get_actual_percent_renewable(country, start, end, True),
+                "forecast": get_forecast_percent_renewable(country, forecast_start, forecast_end),
+            }
+    return results
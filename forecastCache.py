@@ -0,0 +1,143 @@
+"""
+This file contains the forecast cache : the forecast computed by a model for an input window is kept so that it is not computed again
+when a later run gets the same input window. This happens often since ENTSOE data is published late : consecutive hourly runs
+then see the same last hours of actual data.
+
+Entries are keyed by the model name, the SHA-256 hash of the model file and the hash of the input values, so a new version of a model
+file never reuses the forecasts of the previous one. Entries store the unrounded forecast values. The timestamps of the forecast are
+computed from the input data of each run (see `predictionModel.get_forecast_frame`), so a hit only shifts them.
+
+Entries are kept in memory and in one JSON file per model : `data/cache/forecasts/<model name>.json` (the last `max_entries` entries).
+The environment variable `PREDICTIONS_FORECAST_CACHE` selects where the entries are stored :
+- `local` (default) : in memory and in the local files
+- `redis` : also in Redis (key `forecast_cache_<key>`), so that the entries are shared by several containers
+- `none` : the cache is disabled
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+
+modes = ["local", "redis", "none"]
+
+
+def get_input_hash(values):
+    """Returns the hash of the input values of a model"""
+    return hashlib.sha256(np.ascontiguousarray(values, dtype=np.float64).tobytes()).hexdigest()
+
+
+class ForecastCache:
+    """Cache of the forecasts computed by the models
+    :param folder_path : folder of the cache files
+    :param mode : see `modes`. Defaults to `PREDICTIONS_FORECAST_CACHE` or local
+    :param max_entries : number of entries kept for each model
+    :param redis_writer : `RedisWriter` used in the redis mode (created when needed by default)
+    :param ttl_hours : expiry of the entries stored in Redis
+    """
+
+    def __init__(self, folder_path="./data/cache/forecasts", mode=None, max_entries=48, redis_writer=None, ttl_hours=48):
+        self.folder_path = folder_path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.redis_writer = redis_writer
+        self.ttl_hours = ttl_hours
+        # model name -> OrderedDict {key : {"forecast":[], "storedAt":""}}, oldest entry first
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.lookups = 0
+
+    def get_mode(self):
+        mode = self.mode or os.getenv("PREDICTIONS_FORECAST_CACHE", "local")
+        if mode not in modes:
+            raise ValueError(f"Invalid forecast cache mode {mode}, expected {modes}")
+        return mode
+
+    def get_file_path(self, model_name):
+        return os.path.join(self.folder_path, os.path.splitext(model_name)[0] + ".json")
+
+    @staticmethod
+    def get_key(model_name, model_hash, values):
+        return hashlib.sha256(f"{model_name}|{model_hash}|{get_input_hash(values)}".encode()).hexdigest()
+
+    def _get_model_entries(self, model_name):
+        """Returns the entries of the model, reading its cache file the first time"""
+        if model_name not in self._entries:
+            entries = OrderedDict()
+            file_path = self.get_file_path(model_name)
+            if os.path.exists(file_path):
+                try:
+                    with open(file_path, "r") as file:
+                        entries.update(json.load(file))
+                except ValueError as e:
+                    print("Ignoring the invalid forecast cache file "+file_path+" : "+repr(e))
+            self._entries[model_name] = entries
+        return self._entries[model_name]
+
+    def _get_redis_client(self):
+        if self.redis_writer is None:
+            from redisWriter import RedisWriter
+            self.redis_writer = RedisWriter()
+        return self.redis_writer.get_client()
+
+    def get(self, model_name, model_hash, values):
+        """Returns the forecast stored for the model and the input values (np.ndarray), or None
+        :param model_hash : hash of the model file (see `ModelRegistry.get_file_hash`)
+        """
+        mode = self.get_mode()
+        if mode == "none":
+            return None
+        key = self.get_key(model_name, model_hash, values)
+        with self._lock:
+            self.lookups += 1
+            entry = self._get_model_entries(model_name).get(key)
+        forecast = entry["forecast"] if entry is not None else None
+        if forecast is None and mode == "redis":
+            try:
+                value = self._get_redis_client().get("forecast_cache_" + key)
+                forecast = json.loads(value) if value is not None else None
+            except Exception as e:
+                print("Error in reading the forecast cache from redis : "+repr(e))
+        if forecast is None:
+            return None
+        with self._lock:
+            self.hits += 1
+        return np.asarray(forecast, dtype=np.float64)
+
+    def put(self, model_name, model_hash, values, forecast):
+        """Stores the forecast computed by the model for the input values"""
+        mode = self.get_mode()
+        if mode == "none":
+            return
+        key = self.get_key(model_name, model_hash, values)
+        forecast = [float(value) for value in forecast]
+        with self._lock:
+            entries = self._get_model_entries(model_name)
+            entries.pop(key, None)
+            entries[key] = {"forecast": forecast, "storedAt": datetime.now().isoformat()}
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            os.makedirs(self.folder_path, exist_ok=True)
+            file_path = self.get_file_path(model_name)
+            with open(file_path + ".tmp", "w") as file:
+                json.dump(entries, file)
+            os.replace(file_path + ".tmp", file_path)
+        if mode == "redis":
+            try:
+                self._get_redis_client().set("forecast_cache_" + key, json.dumps(forecast), ex=int(self.ttl_hours * 3600))
+            except Exception as e:
+                print("Error in writing the forecast cache to redis : "+repr(e))
+
+    def get_stats(self, reset=False):
+        """Returns the number of lookups, of hits and the hit rate since the last reset"""
+        with self._lock:
+            stats = {"lookups": self.lookups, "hits": self.hits,
+                     "hit_rate": self.hits / self.lookups if self.lookups else 0.0}
+            if reset:
+                self.hits = 0
+                self.lookups = 0
+        return stats
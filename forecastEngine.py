@@ -0,0 +1,272 @@
+"""
+This file contains the inference engine used to roll a prediction model forward over the forecast horizon.
+
+The models in the "model" folder predict a single value (the percentage of renewable energy in the next hour)
+from the last n-1 values of the input window. To obtain a forecast for the next 48 hours, the model is run
+autoregressively : the predicted value is appended to the window, the oldest value is dropped and the model is run again.
+
+Calling `model.predict` for each of these steps is expensive since Keras builds a new data pipeline for every call.
+The engine instead calls a compiled `tf.function` of the model directly on pre-allocated input buffers.
+The window is standardized (zero mean, unit variance) before each step, like the `StandardScaler` used
+while training the models, with statistics that are updated incrementally (see `RollingScaler`).
+
+The main method is `ForecastEngine.forecast(values)`.
+TensorFlow is imported by the functions that need it, so that importing this module (e.g. to list models) stays fast.
+"""
+
+import numpy as np
+
+
+def compile_model(model, seq_length):
+    """Returns a compiled `tf.function` that runs the model in inference mode.
+    The input signature fixes the window length but not the batch size, so the function is traced only once
+    even when it is used to forecast several windows at the same time.
+    :param model : a loaded Keras model
+    :param seq_length : the input sequence length of the model (as stored in the metadata.json file)
+    """
+    import tensorflow as tf
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=[None, seq_length - 1, 1], dtype=tf.float32)])
+    def predict(x):
+        return model(x, training=False)
+    return predict
+
+
+def architecture_signature(model, seq_length):
+    """Returns a hashable description of the architecture of a model : the input sequence length along with the
+    type and the weight shapes of each layer. Models with the same signature can be run together by `compile_model_group`
+    """
+    layers = tuple(
+        (layer.__class__.__name__, tuple(tuple(w.shape) for w in layer.weights)) for layer in model.layers)
+    return (seq_length, layers)
+
+
+def _lstm_is_supported(layer):
+    """Returns True if the LSTM layer uses the configuration that `_stacked_lstm` implements"""
+    config = layer.get_config()
+    return (config["activation"] == "tanh" and config["recurrent_activation"] == "sigmoid" and config["use_bias"]
+            and not config["return_state"] and not config["stateful"] and not config["go_backwards"])
+
+
+def stack_group_weights(models):
+    """Returns the weights of a group of models with the same architecture stacked along a new first axis (one row per model)
+    as a list of (layer type, config, weights) tuples. Returns None if the architecture contains layers that
+    cannot be run with stacked weights, in which case the models are run side by side instead.
+    Supported layers are `LSTM`, `Bidirectional(LSTM)` (with merge_mode 'concat') and `Dense`.
+    """
+    stacked = []
+    for layers in zip(*[model.layers for model in models]):
+        layer = layers[0]
+        kind = layer.__class__.__name__
+        if kind == "InputLayer":
+            continue
+        if kind == "Dense":
+            config = {"activation": layer.get_config()["activation"], "use_bias": layer.get_config()["use_bias"]}
+        elif kind == "LSTM" and _lstm_is_supported(layer):
+            config = {"units": layer.units, "return_sequences": layer.return_sequences}
+        elif kind == "Bidirectional" and layer.merge_mode == "concat" \
+                and layer.forward_layer.__class__.__name__ == "LSTM" and _lstm_is_supported(layer.forward_layer):
+            config = {"units": layer.forward_layer.units, "return_sequences": layer.forward_layer.return_sequences}
+        else:
+            return None
+        weights = [np.stack(w) for w in zip(*[l.get_weights() for l in layers])]
+        stacked.append((kind, config, weights))
+    return stacked
+
+
+def _stacked_lstm(x, kernel, recurrent, bias, units, return_sequences, reverse=False):
+    """Runs an LSTM layer for a batch in which row i is processed with the i-th set of weights.
+    x has the shape (models, time, features). The gates follow the Keras order : input, forget, cell, output
+    """
+    import tensorflow as tf
+    x_proj = tf.einsum("ctf,cfg->ctg", x, kernel) + bias[:, None, :]
+    h = tf.zeros([x.shape[0], units])
+    c = tf.zeros([x.shape[0], units])
+    steps = range(x.shape[1] - 1, -1, -1) if reverse else range(x.shape[1])
+    outputs = []
+    for t in steps:
+        z = x_proj[:, t, :] + tf.einsum("cu,cug->cg", h, recurrent)
+        i, f, g, o = tf.split(z, 4, axis=1)
+        c = tf.sigmoid(f) * c + tf.sigmoid(i) * tf.tanh(g)
+        h = tf.sigmoid(o) * tf.tanh(c)
+        outputs.append(h)
+    if not return_sequences:
+        return h
+    if reverse:
+        outputs.reverse()
+    return tf.stack(outputs, axis=1)
+
+
+def _stacked_forward(x, stacked):
+    """Runs the layers returned by `stack_group_weights` on x (row i of x is the input of the i-th model)"""
+    import tensorflow as tf
+    for kind, config, weights in stacked:
+        if kind == "Dense":
+            activation = tf.keras.activations.get(config["activation"])
+            x = tf.einsum("cf,cfu->cu", x, weights[0])
+            if config["use_bias"]:
+                x = x + weights[1]
+            x = activation(x)
+        elif kind == "LSTM":
+            x = _stacked_lstm(x, *weights, config["units"], config["return_sequences"])
+        else:
+            forward = _stacked_lstm(x, *weights[:3], config["units"], config["return_sequences"])
+            backward = _stacked_lstm(x, *weights[3:], config["units"], config["return_sequences"], reverse=True)
+            x = tf.concat([forward, backward], axis=-1)
+    return x
+
+
+def compile_model_group(models, seq_length):
+    """Returns a compiled `tf.function` that runs a group of models sharing the same architecture in a single call.
+    Row i of the input batch is the input window of the i-th model and row i of the output is its prediction.
+    When all layers are supported by `stack_group_weights`, the weights of the models are stacked and each layer
+    is computed for the whole group with batched matrix products. Otherwise the models are run side by side in one graph.
+    Either way, each forecast step costs a single call for all the models in the group.
+    :param models : list of loaded Keras models with the same `architecture_signature`
+    :param seq_length : the input sequence length shared by the models
+    """
+    import tensorflow as tf
+    stacked = stack_group_weights(models)
+    if stacked is not None:
+        stacked = [(kind, config, [tf.constant(w) for w in weights]) for kind, config, weights in stacked]
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=[len(models), seq_length - 1, 1], dtype=tf.float32)])
+    def predict(x):
+        if stacked is not None:
+            return _stacked_forward(x, stacked)
+        return tf.concat([model(x[i:i + 1], training=False) for i, model in enumerate(models)], axis=0)
+    return predict
+
+
+class RollingScaler:
+    """Standardizes a rolling window of values (zero mean, unit variance) for a batch of independent windows.
+    This replaces refitting a `StandardScaler` on the whole window at every step of the forecast loop : when a value
+    enters the window and the oldest one leaves it, the mean and the variance are updated in O(1).
+
+    The window is stored in a ring buffer of twice the window length in which every value is written twice
+    (at position p and p+n), so the current window is always available as a contiguous view without copying.
+
+    The running statistics are numerically equivalent to the two-pass computation done by `StandardScaler` :
+    over the 48 forecast steps, the scaled values differ by less than 1e-9 (the statistics are recomputed
+    exactly each time a new window is loaded with `fit`). Since forecasts are rounded to integers,
+    the output is identical except for values lying within that tolerance of a rounding boundary.
+    :param batch : number of independent windows
+    :param n : length of each window
+    """
+
+    def __init__(self, batch, n):
+        self.batch = batch
+        self.n = n
+        self._buffer = np.empty((batch, 2 * n), dtype=np.float64)
+        self._position = 0
+        self.mean = np.empty(batch, dtype=np.float64)
+        self._m2 = np.empty(batch, dtype=np.float64)
+        self.scale = np.empty(batch, dtype=np.float64)
+        self._old = np.empty(batch, dtype=np.float64)
+        self._old_mean = np.empty(batch, dtype=np.float64)
+        self._delta = np.empty(batch, dtype=np.float64)
+
+    @property
+    def window(self):
+        """The current windows (oldest value first) as a view of shape (batch, n)"""
+        return self._buffer[:, self._position:self._position + self.n]
+
+    def _update_scale(self):
+        # the variance can become slightly negative due to round-off when all the values are equal
+        np.maximum(self._m2, 0, out=self._m2)
+        np.divide(self._m2, self.n, out=self.scale)
+        np.sqrt(self.scale, out=self.scale)
+        # same handling of constant windows as StandardScaler
+        self.scale[self.scale < 10 * np.finfo(np.float64).eps] = 1.0
+
+    def fit(self, values):
+        """Loads new windows and computes their mean and variance
+        :param values : array of shape (batch, n)
+        """
+        self._position = 0
+        self._buffer[:, :self.n] = values
+        self._buffer[:, self.n:] = values
+        np.mean(values, axis=1, out=self.mean)
+        self._m2[:] = np.sum((values - self.mean[:, None]) ** 2, axis=1)
+        self._update_scale()
+
+    def push(self, values):
+        """Appends one value to each window and drops the oldest one, updating the statistics in O(1)
+        :param values : array of shape (batch,)
+        """
+        p = self._position
+        self._old[:] = self._buffer[:, p]
+        self._buffer[:, p] = values
+        self._buffer[:, p + self.n] = values
+        self._position = (p + 1) % self.n
+        # sliding window update of the mean and the sum of squared differences
+        np.subtract(values, self._old, out=self._delta)
+        self._old_mean[:] = self.mean
+        self.mean += self._delta / self.n
+        self._m2 += self._delta * (values - self.mean + self._old - self._old_mean)
+        self._update_scale()
+
+    def transform(self, out):
+        """Writes the standardized windows into `out` (array of shape (batch, n))"""
+        np.subtract(self.window, self.mean[:, None], out=out)
+        np.divide(out, self.scale[:, None], out=out)
+        return out
+
+    def inverse_transform(self, values):
+        """Returns standardized values (one per window) converted back to the original scale"""
+        return values * self.scale + self.mean
+
+
+class ForecastEngine:
+    """Runs the autoregressive forecast for a model.
+    :param predict_fn : callable mapping a float32 array of shape (batch, seq_length-1, 1) to predictions of shape (batch, 1)
+    :param seq_length : the input sequence length of the model
+    :param steps : the number of hours to forecast (default 48)
+    """
+
+    def __init__(self, predict_fn, seq_length, steps=48):
+        self.predict_fn = predict_fn
+        self.seq_length = seq_length
+        self.steps = steps
+        self._batch = 0
+
+    def _allocate(self, batch):
+        """Allocates the buffers used in the forecast loop. Buffers are reused as long as the batch size does not change"""
+        if batch == self._batch:
+            return
+        self._batch = batch
+        self._scaler = RollingScaler(batch, self.seq_length)
+        self._scaled = np.empty((batch, self.seq_length), dtype=np.float64)
+        self._model_input = np.empty((batch, self.seq_length - 1, 1), dtype=np.float32)
+        self._forecast = np.empty((batch, self.steps), dtype=np.float64)
+
+    def forecast(self, values):
+        """Returns the (unrounded) forecast for the next `steps` hours.
+        :param values : the last `seq_length` actual values. Either a 1-D array or a 2-D array (batch, seq_length) to
+        forecast several independent windows at once
+        :return np.ndarray of shape (steps,) or (batch, steps)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        single = values.ndim == 1
+        values = values.reshape(-1, values.shape[-1])
+        if values.shape[1] != self.seq_length:
+            raise ValueError(
+                f"Expected an input window of {self.seq_length} values, got {values.shape[1]}")
+        batch = values.shape[0]
+        self._allocate(batch)
+        scaler = self._scaler
+        scaled = self._scaled
+        model_input = self._model_input[:, :, 0]
+        scaler.fit(values)
+        for step in range(self.steps):
+            # standardize each window the same way StandardScaler.fit_transform does
+            scaler.transform(out=scaled)
+            model_input[:] = scaled[:, 1:]
+            predicted = np.asarray(self.predict_fn(self._model_input)).reshape(batch)
+            # inverse transform the predicted value
+            predicted = scaler.inverse_transform(predicted)
+            self._forecast[:, step] = predicted
+            # slide the window : drop the oldest value and append the predicted one
+            scaler.push(predicted)
+        result = self._forecast.copy()
+        return result[0] if single else result
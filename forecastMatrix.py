@@ -0,0 +1,173 @@
+"""
+This file contains the forecast matrix : the newest forecasts of all the countries in one binary file with a fixed layout,
+`data/predictions/forecasts.bin`, that other processes on the host can memory-map and read without parsing or copying.
+
+Layout of the file (little endian, see `header_format`) :
+- header (24 bytes) : magic `PRFM`, format version (uint16), value type (uint8 : 0 for int8, 1 for float32), 1 unused byte,
+  number of countries (uint16), number of forecast hours (uint16), time interval in minutes (uint16), 2 unused bytes,
+  issue time of the file (int64, UTC epoch seconds)
+- country codes : 8 bytes per country (ASCII, padded with zeros), sorted
+- start times : the first forecast hour of each country (int64, UTC epoch seconds)
+- values : the matrix countries x hours of the percentage of renewable energy (int8 or float32). Missing hours are NaN (float32) or
+  the sentinel -1 (int8, see `missing_int8`), e.g. the hours of a shorter forecast or of a country kept from a previous file.
+  Converting an int8 matrix with `astype(float)` keeps the sentinel as -1.0 : use `ForecastMatrixReader.to_float` (missing hours are NaN)
+  or `ForecastMatrixReader.missing` (mask of the missing hours) instead
+
+The file is written to a temporary file which then replaces the previous one with an atomic rename. A reader that mapped the previous file
+keeps a consistent view of it and sees the new forecasts after `ForecastMatrixReader.refresh()`, so readers never see a partial update.
+Countries that are not part of a run keep the forecasts of the previous file.
+
+The value type is set with the environment variable `PREDICTIONS_FORECAST_MATRIX` : `int8` (default), `float32` or `none` to not write the file.
+"""
+
+import os
+import mmap
+import struct
+from datetime import datetime, timezone
+import numpy as np
+
+from predictionStore import to_epoch_seconds
+
+header_format = "<4sHBBHHH2xq"
+magic = b"PRFM"
+format_version = 1
+code_size = 8
+value_types = {"int8": (0, np.int8), "float32": (1, np.float32)}
+# value of the missing hours in int8 matrices (percentages are between 0 and 100)
+missing_int8 = -1
+
+
+def get_value_type(name=None):
+    """Returns the value type of the matrix (see `value_types`), or None if the file is disabled"""
+    name = name or os.getenv("PREDICTIONS_FORECAST_MATRIX", "int8")
+    if name == "none":
+        return None
+    if name not in value_types:
+        raise ValueError(f"Invalid forecast matrix type {name}, expected one of {list(value_types) + ['none']}")
+    return name
+
+
+def get_layout(countries, steps, dtype):
+    """Returns the offsets of the country codes, the start times and the values, and the size of the file"""
+    codes = struct.calcsize(header_format)
+    starts = codes + countries * code_size
+    values = starts + countries * 8
+    return codes, starts, values, values + countries * steps * np.dtype(dtype).itemsize
+
+
+def write_forecast_matrix(responses, file_path="./data/predictions/forecasts.bin", value_type=None, steps=48, time_interval=60):
+    """Writes the forecasts of the responses of a run (see `predictionModel.get_response`) to the forecast matrix file,
+    along with the forecasts of the previous file for the other countries
+    :return the number of countries in the file, or None if the file is disabled
+    """
+    value_type = get_value_type(value_type)
+    if value_type is None:
+        return None
+    code, dtype = value_types[value_type]
+    missing = missing_int8 if dtype == np.int8 else np.nan
+    rows = {}
+    if os.path.exists(file_path):
+        try:
+            with ForecastMatrixReader(file_path) as previous:
+                if previous.steps == steps and previous.time_interval == time_interval:
+                    # converted through float so that missing hours stay missing if the value type changed
+                    values = previous.to_float()
+                    for i, country in enumerate(previous.countries):
+                        rows[country] = (int(previous.start[i]), np.where(np.isnan(values[i]), missing, values[i]).astype(dtype))
+        except ValueError as e:
+            print("Ignoring the previous forecast matrix : "+repr(e))
+    for response in responses:
+        output = response["output"]
+        row = np.full(steps, missing, dtype=dtype)
+        # percentages are between 0 and 100, so they fit in a signed byte without wrapping
+        values = np.clip(np.round(output["percentRenewableForecast"].to_numpy(dtype=np.float64)[:steps]), 0, 100)
+        row[:len(values)] = values
+        start = int(to_epoch_seconds(output["startTimeUTC"]).iloc[0]) if len(output) else 0
+        rows[response["input"]["country"]] = (start, row)
+    countries = sorted(rows)
+    codes_offset, starts_offset, values_offset, size = get_layout(len(countries), steps, dtype)
+    buffer = bytearray(size)
+    issued_at = int(datetime.now(timezone.utc).timestamp())
+    struct.pack_into(header_format, buffer, 0, magic, format_version, code, 0, len(countries), steps, time_interval, issued_at)
+    for i, country in enumerate(countries):
+        struct.pack_into(f"{code_size}s", buffer, codes_offset + i * code_size, country.encode("ascii"))
+    np.frombuffer(buffer, dtype="<i8", count=len(countries), offset=starts_offset)[:] = [rows[c][0] for c in countries]
+    matrix = np.frombuffer(buffer, dtype=np.dtype(dtype).newbyteorder("<"), count=len(countries) * steps, offset=values_offset)
+    matrix.reshape(len(countries), steps)[:] = [rows[c][1] for c in countries] if countries else np.empty((0, steps))
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path + ".tmp", "wb") as file:
+        file.write(buffer)
+    os.replace(file_path + ".tmp", file_path)
+    return len(countries)
+
+
+class ForecastMatrixReader:
+    """Reads the forecast matrix file through a memory map. `values` and `start` are read-only NumPy views of the file (no copy)
+    :param file_path : path of the forecast matrix file
+    """
+
+    def __init__(self, file_path="./data/predictions/forecasts.bin"):
+        self.file_path = file_path
+        self._stat = None
+        self._map = None
+        self.refresh()
+
+    def refresh(self):
+        """Maps the file again if it was replaced since the last call. Returns True if the forecasts changed.
+        Views returned before the refresh keep showing the previous forecasts"""
+        stat = os.stat(self.file_path)
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stat:
+            return False
+        with open(self.file_path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, version, code, _, countries, steps, time_interval, issued_at = struct.unpack_from(header_format, mapped)
+        if file_magic != magic or version != format_version:
+            raise ValueError(f"{self.file_path} is not a forecast matrix file of version {format_version}")
+        dtype = np.dtype([t for c, t in value_types.values() if c == code][0]).newbyteorder("<")
+        codes_offset, starts_offset, values_offset, size = get_layout(countries, steps, dtype)
+        if len(mapped) < size:
+            raise ValueError(f"{self.file_path} is truncated")
+        # the previous map is closed when the views that use it are released
+        self._map = mapped
+        self._stat = stamp
+        self.issued_at = issued_at
+        self.time_interval = time_interval
+        self.steps = steps
+        self.countries = [mapped[codes_offset + i * code_size:codes_offset + (i + 1) * code_size].rstrip(b"\0").decode("ascii")
+                          for i in range(countries)]
+        self.positions = {country: i for i, country in enumerate(self.countries)}
+        self.start = np.frombuffer(mapped, dtype="<i8", count=countries, offset=starts_offset)
+        self.values = np.frombuffer(mapped, dtype=dtype, count=countries * steps, offset=values_offset).reshape(countries, steps)
+        return True
+
+    def get(self, country):
+        """Returns (first forecast hour as UTC epoch seconds, view of the forecast values) for the country.
+        Missing hours of int8 matrices are `missing_int8`, see `to_float`"""
+        i = self.positions[country]
+        return int(self.start[i]), self.values[i]
+
+    @property
+    def missing(self) -> np.ndarray:
+        """Boolean matrix countries x hours, True for the hours without forecast"""
+        if self.values.dtype.kind == "f":
+            return np.isnan(self.values)
+        return self.values == missing_int8
+
+    def to_float(self, country=None) -> np.ndarray:
+        """Returns a float32 copy of the values (of all the countries, or of one country) with NaN for the hours without forecast"""
+        values = self.values if country is None else self.values[self.positions[country]]
+        if values.dtype.kind == "f":
+            return values.astype(np.float32)
+        return np.where(values == missing_int8, np.float32(np.nan), values.astype(np.float32))
+
+    def close(self):
+        self._map = None
+        self.start = self.values = None
+        self._stat = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
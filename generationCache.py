@@ -0,0 +1,114 @@
+"""
+This file contains the local cache of the actual generation data fetched from the ENTSOE portal.
+
+For each country, the generation values (one column per production type) are stored in a Parquet file in the `data/cache/generation` folder.
+When data is requested for a time period, only the hours after the last cached timestamp are downloaded and merged into the cache.
+The last `refetch_hours` hours of the cache are downloaded again since ENTSOE values of the recent past can still be completed or updated.
+Rows of the last `publication_lag_hours` hours with missing values (some production types are published late) are downloaded again as well,
+and so are the timestamps of that period that are missing from the cache (ENTSOE sometimes publishes an hour before the previous one).
+Newly downloaded data is always merged with the cached data, so a request for an old time period does not replace the recent data.
+Data older than `retention_days` days before the last cached timestamp is removed from the cache.
+
+The cache can be disabled by setting the environment variable `PREDICTIONS_GENERATION_CACHE` to 0.
+"""
+
+import os
+import threading
+import pandas as pd
+
+
+class GenerationCache:
+    """Parquet cache of generation data per country
+    :param folder_path : folder where the cache files are stored
+    :param retention_days : number of days of data kept in the cache. Defaults to `PREDICTIONS_GENERATION_CACHE_DAYS` or 7
+    :param refetch_hours : number of hours at the end of the cache that are downloaded again
+    :param publication_lag_hours : rows with missing values within this many hours of the end of the cache are downloaded again
+    """
+
+    def __init__(self, folder_path="./data/cache/generation", retention_days=None, refetch_hours=2, publication_lag_hours=24):
+        self.folder_path = folder_path
+        if retention_days is None:
+            retention_days = float(os.getenv("PREDICTIONS_GENERATION_CACHE_DAYS", 7))
+        self.retention = pd.Timedelta(days=retention_days)
+        self.refetch = pd.Timedelta(hours=refetch_hours)
+        self.publication_lag = pd.Timedelta(hours=publication_lag_hours)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock(self, country):
+        """Returns the lock used to avoid concurrent updates of the cache file of a country"""
+        with self._locks_lock:
+            return self._locks.setdefault(country, threading.Lock())
+
+    def get_file_path(self, country):
+        return os.path.join(self.folder_path, country + ".parquet")
+
+    def load(self, country):
+        """Returns the cached data of the country (None if there is no cache)"""
+        file_path = self.get_file_path(country)
+        if not os.path.exists(file_path):
+            return None
+        return pd.read_parquet(file_path)
+
+    def save(self, country, data):
+        """Stores the data of the country. The file is replaced atomically so that readers never see a partial file"""
+        os.makedirs(self.folder_path, exist_ok=True)
+        file_path = self.get_file_path(country)
+        data.to_parquet(file_path + ".tmp")
+        os.replace(file_path + ".tmp", file_path)
+
+    def get_refetch_start(self, cached):
+        """Returns the first cached timestamp that must be downloaded again : the start of the last `refetch_hours` hours,
+        or the first recent row with missing values or the first recent timestamp missing from the cache if it is earlier.
+        Missing timestamps are found on the grid of the interval of the cached data (see `entsoeAPI.get_missing_timestamps`)"""
+        # imported here since entsoeAPI imports this module
+        from entsoeAPI import get_duration_min, get_missing_timestamps
+        last = cached.index.max()
+        refetch_start = last - self.refetch
+        recent_start = last - self.publication_lag
+        recent = cached[cached.index >= recent_start]
+        incomplete = recent.index[recent.isna().any(axis=1)]
+        if len(incomplete):
+            refetch_start = min(refetch_start, incomplete.min())
+        if len(cached) > 1:
+            missing = get_missing_timestamps(cached.index, get_duration_min(cached.index))
+            missing = missing[missing >= recent_start]
+            if len(missing):
+                refetch_start = min(refetch_start, missing.min())
+        return refetch_start
+
+    def get(self, country, start, end, fetch):
+        """Returns the data of the country between start and end (both included), downloading only what is missing from the cache.
+        :param start, end : pd.Timestamp (timezone aware)
+        :param fetch : function(start, end) downloading the data for the given period. Returns a DataFrame with a datetime index
+        """
+        from entsoe.exceptions import NoMatchingDataError
+        with self._lock(country):
+            existing = self.load(country)
+            if existing is not None and len(existing) == 0:
+                existing = None
+            if existing is None or existing.index.min() > start:
+                # the cache does not cover the beginning of the period : everything is downloaded
+                fetch_start = start
+                covered = None
+            else:
+                fetch_start = max(start, self.get_refetch_start(existing).tz_convert(start.tz))
+                covered = existing
+            if fetch_start >= end:
+                # the cache covers the whole period
+                return covered[(covered.index >= start) & (covered.index <= end)]
+            try:
+                fetched = fetch(fetch_start, end)
+            except NoMatchingDataError:
+                if covered is None:
+                    raise
+                fetched = covered.iloc[:0]
+            if existing is None:
+                merged = fetched
+            else:
+                # newly downloaded values replace the cached ones for the same timestamps, the other cached rows are kept
+                merged = pd.concat([existing, fetched])
+                merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+            if len(merged):
+                self.save(country, merged[merged.index >= merged.index.max() - self.retention])
+            return merged[(merged.index >= start) & (merged.index <= end)]
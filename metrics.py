@@ -0,0 +1,145 @@
+"""
+This file contains the metrics of the prediction runs : the duration of each stage (ENTSOE download, data refining, conversion to
+60 minute intervals, model loading, inference, writes to the store, Redis and the logs) for each country, along with row counts,
+gap counts and the memory high-water mark of the process.
+
+Stages are measured with `metrics.stage(name)` or reported with `metrics.record(name, duration=...)`. The country of a measurement
+is the one set with `metrics.set_country` by the thread processing the country (see `savePredictions.runPredictions`).
+Measurements are kept in memory during a run and written by `flush()` at the end of the run, in the formats listed in the
+environment variable `PREDICTIONS_METRICS` (comma separated, default `json`) :
+- `json` : one JSON object per line, appended to `data/metrics/metrics-<year>-<month>.jsonl`
+- `prometheus` : the file `data/metrics/predictions.prom` (replaced at every run) with the metrics of the last run,
+  for the textfile collector of the Prometheus node exporter
+- `none` : metrics are not written
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+formats = ["json", "prometheus", "none"]
+
+
+def get_max_rss_mb():
+    """Returns the memory high-water mark (maximum resident set size) of the process in MB"""
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class Metrics:
+    """Collects the measurements of a run and writes them
+    :param folder_path : folder where the metric files are written
+    :param output_formats : list of formats (see `formats`). Defaults to `PREDICTIONS_METRICS` or json
+    """
+
+    def __init__(self, folder_path="./data/metrics", output_formats=None):
+        self.folder_path = folder_path
+        self.output_formats = output_formats
+        self.run_id = None
+        self._events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_formats(self):
+        output_formats = self.output_formats
+        if output_formats is None:
+            output_formats = [f.strip() for f in os.getenv("PREDICTIONS_METRICS", "json").split(",") if f.strip()]
+        invalid = [f for f in output_formats if f not in formats]
+        if invalid:
+            raise ValueError(f"Invalid metrics format {invalid}, expected {formats}")
+        return [f for f in output_formats if f != "none"]
+
+    def set_country(self, country):
+        """Sets the country of the measurements made by the current thread"""
+        self._local.country = country
+
+    def get_country(self):
+        return getattr(self._local, "country", None)
+
+    def start_run(self):
+        """Starts a new run : measurements not written yet are dropped"""
+        with self._lock:
+            self.run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+            self._events = []
+
+    def record(self, name, **fields):
+        """Adds a measurement of the stage `name`. Fields are numbers (duration in seconds, rows, gaps...) or strings"""
+        event = {"time": datetime.now().isoformat(), "run": self.run_id, "stage": name,
+                 "country": fields.pop("country", self.get_country())}
+        event.update(fields)
+        event["max_rss_mb"] = get_max_rss_mb()
+        with self._lock:
+            self._events.append(event)
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """Measures the duration of the code run in the `with` block. The block can add fields to the yielded dictionary.
+        If the block raises an exception, the measurement has the field `error`"""
+        start = time.perf_counter()
+        try:
+            yield fields
+        except Exception as e:
+            fields["error"] = repr(e)
+            raise
+        finally:
+            self.record(name, duration=time.perf_counter() - start, **fields)
+
+    def get_events(self):
+        with self._lock:
+            return list(self._events)
+
+    def flush(self):
+        """Writes the measurements of the run in the configured formats"""
+        output_formats = self.get_formats()
+        with self._lock:
+            events, self._events = self._events, []
+        if not output_formats or not events:
+            return
+        os.makedirs(self.folder_path, exist_ok=True)
+        if "json" in output_formats:
+            file_path = os.path.join(self.folder_path, "metrics-" + datetime.now().strftime('%Y-%m') + ".jsonl")
+            with open(file_path, "a") as file:
+                file.write("".join(json.dumps(event) + "\n" for event in events))
+        if "prometheus" in output_formats:
+            file_path = os.path.join(self.folder_path, "predictions.prom")
+            with open(file_path + ".tmp", "w") as file:
+                file.write(self.to_prometheus(events))
+            os.replace(file_path + ".tmp", file_path)
+
+    @staticmethod
+    def to_prometheus(events):
+        """Returns the measurements in the Prometheus text format. Numeric fields are summed per stage and country"""
+        totals = {}
+        for event in events:
+            labels = (event["stage"], event["country"] or "")
+            for field, value in event.items():
+                if field in ["time", "run", "stage", "country", "max_rss_mb"] or isinstance(value, bool) \
+                        or not isinstance(value, (int, float)):
+                    continue
+                name = "predictions_stage_" + ("duration_seconds" if field == "duration" else field)
+                totals.setdefault(name, {}).setdefault(labels, 0)
+                totals[name][labels] += value
+        lines = []
+        for name, values in totals.items():
+            lines.append(f"# TYPE {name} gauge")
+            for (stage, country), value in values.items():
+                lines.append(f'{name}{{stage="{stage}",country="{country}"}} {value}')
+        max_rss = [event["max_rss_mb"] for event in events if event["max_rss_mb"] is not None]
+        if max_rss:
+            lines += ["# TYPE predictions_max_rss_bytes gauge", f"predictions_max_rss_bytes {int(max(max_rss) * 1024 * 1024)}"]
+        lines += ["# TYPE predictions_last_run_timestamp_seconds gauge", f"predictions_last_run_timestamp_seconds {int(time.time())}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,212 @@
+"""
+This file contains the registry of the prediction models stored in the "model" folder.
+
+The registry scans the folder and the metadata.json file once and builds an index of the available versions for each country.
+The index is rebuilt only when the folder or the metadata file is modified.
+Loaded models (along with their compiled forecast engines) are kept in an in-process LRU cache so that a long running process
+can generate forecasts repeatedly without reloading the weights from disk. A cached model is reloaded if its file is modified.
+
+The size of the cache is limited by a memory budget (in MB) that can be set with the environment variable `PREDICTIONS_MODEL_CACHE_MB`.
+The memory used by a model is estimated with the size of its file.
+
+Models are run with NumPy when their `.npz` file (see `numpyModel.py`) is present and up to date, which avoids loading TensorFlow.
+Otherwise they are loaded with Keras. Setting the environment variable `PREDICTIONS_MODEL_BACKEND` to `keras` disables the NumPy backend.
+"""
+
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+
+from numpyModel import NumpyModel, get_npz_path, get_file_hash
+from metrics import metrics
+
+model_file_pattern = re.compile(r"^(?P<country>[^_]+)_v(?P<version>\d+)\.h5$")
+
+
+class ModelRegistry:
+    """Index of the models available in a folder and LRU cache of loaded models
+    :param folder_path : path of the folder containing the models and the metadata.json file
+    :param memory_budget_mb : maximum memory (in MB) used by cached models. Defaults to `PREDICTIONS_MODEL_CACHE_MB` or 512
+    """
+
+    def __init__(self, folder_path="./models", memory_budget_mb=None):
+        self.folder_path = folder_path
+        if memory_budget_mb is None:
+            memory_budget_mb = float(os.getenv("PREDICTIONS_MODEL_CACHE_MB", 512))
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._lock = threading.RLock()
+        self._index_stamp = None
+        self._versions = {}
+        self._metadata = {}
+        # model name -> {"mtime":, "size":, "backend":, "model":, "engines":{}}
+        self._cache = OrderedDict()
+        self._cache_size = 0
+        # (tuple of (model name, mtime), seq_length) -> forecast engine for a group of models
+        self._group_engines = {}
+        # model name -> (mtime, hash of the model file)
+        self._hashes = {}
+
+    def _stamp(self):
+        """Returns the modification times of the folder and the metadata file, used to detect changes"""
+        metadata_path = os.path.join(self.folder_path, "metadata.json")
+        metadata_mtime = os.stat(metadata_path).st_mtime_ns if os.path.exists(metadata_path) else None
+        return (os.stat(self.folder_path).st_mtime_ns, metadata_mtime)
+
+    def refresh(self, force=False):
+        """Rebuilds the index of models and the metadata if the folder or the metadata file changed since the last scan"""
+        with self._lock:
+            stamp = self._stamp()
+            if not force and stamp == self._index_stamp:
+                return
+            versions = {}
+            for fileName in os.listdir(self.folder_path):
+                match = model_file_pattern.match(fileName)
+                if match and os.path.isfile(os.path.join(self.folder_path, fileName)):
+                    versions.setdefault(match["country"], []).append((int(match["version"]), fileName))
+            for country in versions:
+                versions[country].sort()
+            metadata = {}
+            metadata_path = os.path.join(self.folder_path, "metadata.json")
+            if os.path.exists(metadata_path):
+                with open(metadata_path, "r") as file:
+                    for obj in json.load(file)["models"]:
+                        metadata[obj["name"]] = obj
+            self._versions = versions
+            self._metadata = metadata
+            self._index_stamp = stamp
+
+    def get_countries(self):
+        """Returns the list of country codes for which at least one model is available"""
+        self.refresh()
+        return list(self._versions)
+
+    def get_versions(self, country):
+        """Returns the list of (version number, model file name) available for the country, sorted by version"""
+        self.refresh()
+        return list(self._versions.get(country, []))
+
+    def get_latest_model_name(self, country):
+        """Returns the file name of the model with the highest version number for the country (None if there is no model)"""
+        versions = self.get_versions(country)
+        return versions[-1][1] if versions else None
+
+    def get_metadata(self, model_name):
+        """Returns the metadata of the model stored in the metadata.json file"""
+        self.refresh()
+        if model_name not in self._metadata:
+            raise Exception("Invalid model name")
+        return self._metadata[model_name]
+
+    def get_file_hash(self, model_name):
+        """Returns the SHA-256 hash of the model file. The hash is computed again only when the file is modified"""
+        with self._lock:
+            file_path = os.path.join(self.folder_path, model_name)
+            mtime = os.stat(file_path).st_mtime_ns
+            cached = self._hashes.get(model_name)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, get_file_hash(file_path))
+                self._hashes[model_name] = cached
+            return cached[1]
+
+    def _evict(self, model_name):
+        entry = self._cache.pop(model_name)
+        self._cache_size -= entry["size"]
+        self._group_engines = {key: engine for key, engine in self._group_engines.items()
+                               if model_name not in [name for name, _ in key[0]]}
+
+    def _stat(self, file_path):
+        """Returns the modification times of the model file and of its NumPy weight file, used to detect changes"""
+        npz_path = get_npz_path(file_path)
+        return (os.stat(file_path).st_mtime_ns, os.stat(npz_path).st_mtime_ns if os.path.exists(npz_path) else None)
+
+    def _load(self, model_name, file_path):
+        """Returns (backend, loaded model) : the NumPy model if its weight file was converted from the current model file, else the Keras model"""
+        with metrics.stage("model_load", model=model_name) as stage:
+            npz_path = get_npz_path(file_path)
+            stage["backend"] = "numpy"
+            if os.getenv("PREDICTIONS_MODEL_BACKEND", "numpy") != "keras" and os.path.exists(npz_path):
+                model = NumpyModel.load(npz_path)
+                if model.source_hash == get_file_hash(file_path):
+                    return "numpy", model
+                print(f"{npz_path} was not converted from the current version of {model_name}, using Keras")
+            stage["backend"] = "keras"
+            from tensorflow.keras.models import load_model
+            return "keras", load_model(file_path, compile=False)
+
+    def _get_entry(self, model_name):
+        """Returns the cache entry of the model, loading the model if it is not cached or if its files changed"""
+        with self._lock:
+            file_path = os.path.join(self.folder_path, model_name)
+            mtime = self._stat(file_path)
+            entry = self._cache.get(model_name)
+            if entry is not None and entry["mtime"] != mtime:
+                self._evict(model_name)
+                entry = None
+            if entry is None:
+                backend, model = self._load(model_name, file_path)
+                entry = {"mtime": mtime, "size": os.stat(file_path).st_size,
+                         "backend": backend, "model": model, "engines": {}}
+                self._cache[model_name] = entry
+                self._cache_size += entry["size"]
+                # evict least recently used models, but always keep the one just loaded
+                while self._cache_size > self.memory_budget and len(self._cache) > 1:
+                    self._evict(next(iter(self._cache)))
+            else:
+                self._cache.move_to_end(model_name)
+            return entry
+
+    def get_model(self, model_name):
+        """Returns the loaded model (a Keras model or a `NumpyModel`)"""
+        return self._get_entry(model_name)["model"]
+
+    def get_backend(self, model_name):
+        """Returns the backend used to run the model : numpy or keras"""
+        return self._get_entry(model_name)["backend"]
+
+    def get_signature(self, model_name, seq_length):
+        """Returns a hashable description of the architecture of the model and of its backend.
+        Models with the same signature can be run together by `get_group_engine`
+        """
+        from forecastEngine import architecture_signature
+        entry = self._get_entry(model_name)
+        if entry["backend"] == "numpy":
+            return (seq_length, "numpy", entry["model"].signature())
+        return (seq_length, "keras", architecture_signature(entry["model"], seq_length)[1])
+
+    def get_engine(self, model_name, seq_length):
+        """Returns the forecast engine of the model for the given input sequence length.
+        The engine (and its compiled tf.function for Keras models) is cached along with the model.
+        """
+        from forecastEngine import ForecastEngine, compile_model
+        with self._lock:
+            entry = self._get_entry(model_name)
+            if seq_length not in entry["engines"]:
+                predict = entry["model"] if entry["backend"] == "numpy" else compile_model(entry["model"], seq_length)
+                entry["engines"][seq_length] = ForecastEngine(predict, seq_length)
+            return entry["engines"][seq_length]
+
+    def get_group_engine(self, model_names, seq_length):
+        """Returns the forecast engine running a group of models with the same signature (see `get_signature`) in a single call
+        (see `NumpyModel.stack` and `forecastEngine.compile_model_group`). The engine is cached as long as none of the models changes.
+        """
+        from forecastEngine import ForecastEngine, compile_model_group
+        with self._lock:
+            entries = [self._get_entry(name) for name in model_names]
+            key = (tuple((name, entry["mtime"]) for name, entry in zip(model_names, entries)), seq_length)
+            if key not in self._group_engines:
+                models = [entry["model"] for entry in entries]
+                if all(entry["backend"] == "numpy" for entry in entries):
+                    predict = NumpyModel.stack(models)
+                else:
+                    predict = compile_model_group(models, seq_length)
+                self._group_engines[key] = ForecastEngine(predict, seq_length)
+            return self._group_engines[key]
+
+    def clear(self):
+        """Removes all the models from the cache"""
+        with self._lock:
+            self._cache.clear()
+            self._cache_size = 0
+            self._group_engines = {}
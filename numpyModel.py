@@ -0,0 +1,177 @@
+"""
+This file contains the NumPy backend of the prediction models : the weights of a Keras model are exported to a `.npz` file
+and the model is evaluated with a forward pass written in NumPy, so that forecasts can be generated without loading TensorFlow.
+
+The conversion step creates, for each model listed in the metadata.json file, a file with the same name and the `.npz` extension
+(e.g. `models/BE_v1.npz` for `models/BE_v1.h5`). After the conversion, the outputs of the NumPy model are compared with the
+outputs of the Keras model on random input windows and the file is kept only if they match.
+The `.npz` file also stores the SHA-256 hash of the `.h5` file it was converted from. When the `.npz` file of a model is present
+and its hash matches the current `.h5` file, the model registry uses it instead of Keras (see `modelRegistry.py`).
+
+The supported layers are the ones of `forecastEngine.stack_group_weights` : `LSTM`, `Bidirectional(LSTM)` and `Dense`.
+The weights of each layer have a leading axis with one row per model, so a group of models with the same architecture
+can be evaluated in a single call, like `forecastEngine.compile_model_group` does.
+
+Usage : `python numpyModel.py [model file names]` (all the models of the metadata.json file by default)
+"""
+
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+
+
+def get_npz_path(model_path):
+    """Returns the path of the NumPy weight file of a model from the path of its `.h5` file"""
+    return os.path.splitext(model_path)[0] + ".npz"
+
+
+def get_file_hash(file_path):
+    """Returns the SHA-256 hash of a file"""
+    with open(file_path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def _lstm(x, kernel, recurrent, bias, units, return_sequences, reverse):
+    """Runs the directions of an LSTM layer together. x has the shape (batch, time, features) and the weights have the shape
+    (directions, models, ...) where models is 1 (same weights for all rows) or batch (row i is processed with the i-th weights).
+    reverse is the list of the directions that process the sequence backwards. The gates follow the Keras order : input, forget, cell, output
+    :return array of shape (directions, batch, time, units) or (directions, batch, units) if return_sequences is False
+    """
+    x_proj = np.matmul(x[None], kernel) + bias[:, :, None, :]
+    for direction in reverse:
+        x_proj[direction] = x_proj[direction, :, ::-1]
+    h = np.zeros(x_proj.shape[:2] + (1, units), dtype=x.dtype)
+    c = np.zeros(x_proj.shape[:2] + (units,), dtype=x.dtype)
+    outputs = []
+    for t in range(x.shape[1]):
+        z = x_proj[:, :, t, :] + np.matmul(h, recurrent)[:, :, 0, :]
+        gates = _sigmoid(z)
+        c = gates[..., units:2 * units] * c + gates[..., :units] * np.tanh(z[..., 2 * units:3 * units])
+        h = (gates[..., 3 * units:] * np.tanh(c))[:, :, None, :]
+        outputs.append(h)
+    if not return_sequences:
+        return h[:, :, 0, :]
+    outputs = np.concatenate(outputs, axis=2)
+    for direction in reverse:
+        outputs[direction] = outputs[direction, :, ::-1]
+    return outputs
+
+
+activations = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": _sigmoid,
+    "tanh": np.tanh,
+}
+
+
+class NumpyModel:
+    """A prediction model evaluated with NumPy
+    :param layers : list of (layer type, config, list of weights) as returned by `forecastEngine.stack_group_weights`
+    :param source_hash : hash of the `.h5` file the weights were exported from
+    """
+
+    def __init__(self, layers, source_hash=None):
+        self.layers = [(kind, config, [np.asarray(w, dtype=np.float32) for w in weights]) for kind, config, weights in layers]
+        self.source_hash = source_hash
+
+    def __call__(self, x):
+        """Returns the predictions of the model for a float32 array of shape (batch, time, features)"""
+        x = np.asarray(x, dtype=np.float32)
+        for kind, config, weights in self.layers:
+            if kind == "Dense":
+                x = np.matmul(x[:, None, :], weights[0])[:, 0, :]
+                if config["use_bias"]:
+                    x = x + weights[1]
+                x = activations[config["activation"]](x)
+            elif kind == "LSTM":
+                x = _lstm(x, *[w[None] for w in weights], config["units"], config["return_sequences"], [])[0]
+            else:
+                # the forward and the backward layers are run together as two directions
+                directions = [np.stack([forward, backward]) for forward, backward in zip(weights[:3], weights[3:])]
+                forward, backward = _lstm(x, *directions, config["units"], config["return_sequences"], [1])
+                x = np.concatenate([forward, backward], axis=-1)
+        return x
+
+    def signature(self):
+        """Returns a hashable description of the architecture : the type and the weight shapes (without the model axis) of each layer"""
+        return tuple((kind, tuple(w.shape[1:] for w in weights)) for kind, _, weights in self.layers)
+
+    @classmethod
+    def stack(cls, models):
+        """Returns a model running a group of models with the same signature in a single call (row i of the input is run with the i-th model)"""
+        return cls([(kind, config, [np.concatenate(w) for w in zip(*[model.layers[i][2] for model in models])])
+                    for i, (kind, config, _) in enumerate(models[0].layers)])
+
+    @classmethod
+    def from_keras(cls, model):
+        """Returns the NumPy version of a loaded Keras model. Raises a ValueError if the model contains unsupported layers"""
+        from forecastEngine import stack_group_weights
+        layers = stack_group_weights([model])
+        if layers is None:
+            raise ValueError("The model contains layers that are not supported by the NumPy backend")
+        return cls(layers)
+
+    def save(self, file_path):
+        """Saves the model. The file is replaced atomically so that a running process never loads a partial file"""
+        arrays = {f"weights_{i}_{j}": w for i, (_, _, weights) in enumerate(self.layers) for j, w in enumerate(weights)}
+        layers = [(kind, config, len(weights)) for kind, config, weights in self.layers]
+        with open(file_path + ".tmp", "wb") as file:
+            np.savez(file, layers=np.array(json.dumps(layers)), source_hash=np.array(self.source_hash or ""), **arrays)
+        os.replace(file_path + ".tmp", file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            layers = json.loads(str(data["layers"]))
+            return cls([(kind, config, [data[f"weights_{i}_{j}"] for j in range(count)])
+                        for i, (kind, config, count) in enumerate(layers)], str(data["source_hash"]) or None)
+
+
+def check_parity(keras_model, numpy_model, seq_length, windows=64, seed=0):
+    """Returns the largest absolute difference between the outputs of the Keras and the NumPy model on random standardized input windows"""
+    x = np.random.default_rng(seed).normal(size=(windows, seq_length - 1, 1)).astype(np.float32)
+    expected = keras_model(x, training=False).numpy()
+    return float(np.abs(numpy_model(x) - expected).max())
+
+
+def convert_model(model_name, folder_path="./models", tolerance=1e-4):
+    """Exports the weights of a model to its `.npz` file after checking that the NumPy model gives the same outputs as the Keras model
+    :param model_name : file name of the model, e.g. "BE_v1.h5"
+    :param tolerance : largest accepted difference between the outputs (the models output standardized values)
+    :return the largest difference between the outputs
+    """
+    from tensorflow.keras.models import load_model
+    from modelRegistry import ModelRegistry
+    seq_length = ModelRegistry(folder_path).get_metadata(model_name)["input_sequence"]
+    model_path = os.path.join(folder_path, model_name)
+    keras_model = load_model(model_path, compile=False)
+    numpy_model = NumpyModel.from_keras(keras_model)
+    numpy_model.source_hash = get_file_hash(model_path)
+    difference = check_parity(keras_model, numpy_model, seq_length)
+    if difference > tolerance:
+        raise ValueError(f"The outputs of the NumPy model differ from the Keras model by {difference}")
+    numpy_model.save(get_npz_path(model_path))
+    return difference
+
+
+def main(model_names=None, folder_path="./models"):
+    if not model_names:
+        with open(os.path.join(folder_path, "metadata.json"), "r") as file:
+            model_names = [model["name"] for model in json.load(file)["models"]]
+    for model_name in model_names:
+        try:
+            difference = convert_model(model_name, folder_path)
+            print(f"{model_name} converted (largest difference with Keras : {difference:.2e})")
+        except Exception as e:
+            print(f"{model_name} not converted : {e!r}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
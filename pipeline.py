@@ -0,0 +1,110 @@
+"""
+This file contains the pipeline used to generate predictions for several countries concurrently.
+
+Each country goes through three stages : fetch (download the input data), inference (run the model) and save (store the predictions).
+Fetching and saving are mostly waiting for the network or the disk, so they run in thread pools with a configurable number of workers.
+Inference runs in a single worker, so TensorFlow is never used by two threads at the same time.
+Stages are chained per country : the model of a country runs as soon as its data is fetched, while other countries are still being fetched.
+
+Failures are isolated : if a stage fails for a country, the error is recorded and the other countries are processed normally.
+"""
+
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Pipeline:
+    """Runs items through the fetch, inference and save stages.
+    :param fetch : function(item) returning the input of the inference stage
+    :param infer : function(fetched value) returning the input of the save stage
+    :param save : function(item, inferred value)
+    :param fetch_workers : maximum number of concurrent fetches
+    :param save_workers : maximum number of concurrent saves
+    :param infer_batch : optional function(list of fetched values) returning the list of inferred values.
+    If provided, inference waits for all the fetches and runs once for all the items. If it fails, each item is inferred separately
+    """
+
+    def __init__(self, fetch, infer, save, fetch_workers=4, save_workers=2, infer_batch=None):
+        self.fetch = fetch
+        self.infer = infer
+        self.save = save
+        self.fetch_workers = fetch_workers
+        self.save_workers = save_workers
+        self.infer_batch = infer_batch
+        self._lock = threading.Lock()
+
+    def _timed(self, stage, timings, func, *args):
+        """Runs the function and adds its duration to the time spent in the stage"""
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                timings[stage] += time.perf_counter() - start
+
+    def run(self, items, skip=None):
+        """Runs all the items through the pipeline
+        :param items : list of items (e.g. country codes)
+        :param skip : optional function(item, fetched value) returning True if the item does not need to be inferred and saved
+        :return dictionary {"completed":[items], "skipped":[items], "errors":{item:{"stage":, "error":}},
+        "timings":{stage : total duration in seconds}, "wall": duration of the run in seconds}
+        """
+        start = time.perf_counter()
+        timings = {"fetch": 0.0, "inference": 0.0, "save": 0.0}
+        result = {"completed": [], "skipped": [], "errors": {}, "timings": timings}
+        ready = []
+        batch_submitted = False
+        with ThreadPoolExecutor(self.fetch_workers) as fetch_pool, \
+                ThreadPoolExecutor(1) as infer_pool, \
+                ThreadPoolExecutor(self.save_workers) as save_pool:
+
+            def submit_inference(item, value):
+                pending[infer_pool.submit(self._timed, "inference", timings, self.infer, value)] = ("inference", item)
+
+            def submit_save(item, value):
+                pending[save_pool.submit(self._timed, "save", timings, self.save, item, value)] = ("save", item)
+
+            # future -> (stage, item)
+            pending = {fetch_pool.submit(self._timed, "fetch", timings, self.fetch, item): ("fetch", item) for item in items}
+            while pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, item = pending.pop(future)
+                    try:
+                        value = future.result()
+                    except Exception as e:
+                        if stage == "batch":
+                            # run the items of the failed batch one by one to isolate the failure
+                            print("Error in batched inference, running models separately : "+repr(e))
+                            for batch_item, fetched in item:
+                                submit_inference(batch_item, fetched)
+                        else:
+                            print(f"Error in {stage} for {item} : {e!r}")
+                            traceback.print_exc()
+                            result["errors"][item] = {"stage": stage, "error": repr(e)}
+                        continue
+                    if stage == "fetch":
+                        if skip is not None and skip(item, value):
+                            result["skipped"].append(item)
+                        elif self.infer_batch is None:
+                            submit_inference(item, value)
+                        else:
+                            ready.append((item, value))
+                    elif stage == "batch":
+                        for (batch_item, _), inferred in zip(item, value):
+                            submit_save(batch_item, inferred)
+                    elif stage == "inference":
+                        submit_save(item, value)
+                    else:
+                        result["completed"].append(item)
+                # in batched mode, inference starts once all the fetches are done
+                fetching = any(stage == "fetch" for stage, _ in pending.values())
+                if self.infer_batch is not None and not fetching and ready and not batch_submitted:
+                    batch_submitted = True
+                    batch = list(ready)
+                    future = infer_pool.submit(self._timed, "inference", timings, self.infer_batch, [v for _, v in batch])
+                    pending[future] = ("batch", batch)
+        result["wall"] = time.perf_counter() - start
+        return result
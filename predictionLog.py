@@ -0,0 +1,117 @@
+"""
+This file contains the log of the model runs : for each run, the model, the input window and the 48 hour forecast.
+
+Runs are logged as JSON lines, one file per country and month : `data/logs/<country>-<year>-<month>.jsonl`.
+Each line has the fields :
+- loggedAt : time of the run (ISO format, local time)
+- country, model
+- inputStart, inputEnd : first and last hour of the input window ('YYYYMMDDhhmm' in UTC)
+- input : the percentage of renewable energy of each hour of the input window
+- forecastStart : first forecast hour ('YYYYMMDDhhmm' in UTC)
+- forecast : the forecast percentage of renewable energy of each hour, starting at forecastStart
+
+Records are buffered in memory and written to the files by `flush()` (once per run, or when the buffer is full),
+so a run opens each log file once. `query()` loads the runs logged in a time window into a DataFrame.
+"""
+
+import os
+import json
+import glob
+import threading
+from datetime import datetime
+import pandas as pd
+
+from predictionStore import to_epoch_seconds
+
+
+class PredictionLog:
+    """Buffered JSON lines log of the model runs
+    :param folder_path : folder of the log files
+    :param buffer_size : number of records kept in memory before they are written
+    """
+
+    def __init__(self, folder_path="./data/logs", buffer_size=100):
+        self.folder_path = folder_path
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def get_file_path(self, country, month):
+        """Returns the path of the log file of the country for the month (a datetime)"""
+        return os.path.join(self.folder_path, f"{country}-{month.strftime('%Y-%m')}.jsonl")
+
+    def append(self, response):
+        """Adds a model run to the log
+        :param response : response of `predictionModel.get_response`
+        """
+        inputs = response["input"]
+        output = response["output"]
+        logged_at = datetime.now()
+        forecast_start = pd.to_datetime(to_epoch_seconds(output["startTimeUTC"]).iloc[0], unit="s") if len(output) else None
+        record = {
+            "loggedAt": logged_at.isoformat(),
+            "country": inputs["country"],
+            "model": inputs["model"],
+            "inputStart": str(inputs["start"]),
+            "inputEnd": str(inputs["end"]),
+            "input": [int(value) for value in inputs["percentRenewable"]],
+            "forecastStart": forecast_start.strftime('%Y%m%d%H%M') if forecast_start is not None else None,
+            "forecast": output["percentRenewableForecast"].astype(int).tolist(),
+        }
+        with self._lock:
+            self._buffer.append((self.get_file_path(inputs["country"], logged_at), record))
+            full = len(self._buffer) >= self.buffer_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered records, opening each log file once"""
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+            files = {}
+            for file_path, record in buffer:
+                files.setdefault(file_path, []).append(json.dumps(record) + "\n")
+            if files:
+                os.makedirs(self.folder_path, exist_ok=True)
+            for file_path, lines in files.items():
+                with open(file_path, "a") as log_file:
+                    log_file.write("".join(lines))
+
+    def query(self, start=None, end=None, countries=None, explode=False) -> pd.DataFrame:
+        """Returns the model runs logged between start and end (both included)
+        :param start, end : datetimes in local time (default : no limit)
+        :param countries : list of country codes (default : all countries)
+        :param explode : if True, returns one row per forecast hour with the columns loggedAt, country, model, inputEnd,
+        startTimeUTC, leadTime (hours after the end of the input, starting at 1) and percentRenewableForecast
+        :return pd.DataFrame with one row per run and the fields of the records as columns (loggedAt as a datetime)
+        """
+        self.flush()
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        frames = []
+        for file_path in sorted(glob.glob(os.path.join(self.folder_path, "*-*-*.jsonl"))):
+            country, year, month = os.path.basename(file_path)[:-len(".jsonl")].rsplit("-", 2)
+            month_start = pd.Timestamp(year=int(year), month=int(month), day=1)
+            # only the files of the months overlapping the time window are read
+            if countries is not None and country not in countries or \
+                    end is not None and month_start > end or \
+                    start is not None and month_start + pd.offsets.MonthBegin(1) <= start:
+                continue
+            frames.append(pd.read_json(file_path, lines=True, dtype={"inputStart": str, "inputEnd": str, "forecastStart": str}))
+        columns = ["loggedAt", "country", "model", "inputStart", "inputEnd", "input", "forecastStart", "forecast"]
+        runs = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+        runs["loggedAt"] = pd.to_datetime(runs["loggedAt"])
+        if start is not None:
+            runs = runs[runs["loggedAt"] >= start]
+        if end is not None:
+            runs = runs[runs["loggedAt"] <= end]
+        runs = runs.sort_values("loggedAt").reset_index(drop=True)
+        if not explode:
+            return runs
+        hours = runs[["loggedAt", "country", "model", "inputEnd", "forecastStart", "forecast"]].explode("forecast")
+        hours["leadTime"] = hours.groupby(level=0).cumcount() + 1
+        hours["startTimeUTC"] = pd.to_datetime(hours["forecastStart"], format='%Y%m%d%H%M') + \
+            pd.to_timedelta(hours["leadTime"] - 1, unit="h")
+        hours = hours.rename(columns={"forecast": "percentRenewableForecast"}).astype({"percentRenewableForecast": int})
+        return hours[["loggedAt", "country", "model", "inputEnd", "startTimeUTC", "leadTime", "percentRenewableForecast"]] \
+            .reset_index(drop=True)
@@ -8,24 +8,24 @@ The main method is `model_run_latest(country)`.
 """
 
 import os
-import json
 import pandas as pd
 from datetime import datetime, timedelta
 import numpy as np
-from sklearn.preprocessing import StandardScaler
-from tensorflow.keras.models import load_model
 
 import entsoeAPI as en
+from modelRegistry import ModelRegistry
+from forecastCache import ForecastCache
+from accuracyTracker import AccuracyTracker
+from metrics import metrics
+
+registry = ModelRegistry("./models")
+forecast_cache = ForecastCache()
+accuracy_tracker = AccuracyTracker()
+
 
 def get_model_metadata(model):
     """Returns metadata for the selected model from the metadata.json file in the model folder"""
-    with open("./models/metadata.json", "r") as file:
-        data = json.load(file)
-        obj = [o for o in data["models"] if o["name"] == model]
-        if len(obj) == 1:
-            return obj[0]
-        else:
-            raise Exception("Invalid model name")
+    return registry.get_metadata(model)
 
 
 def get_available_country_list():
@@ -33,29 +33,26 @@ def get_available_country_list():
     All models are stored in the 'model' folder. There can be multiple models for one country.
     This method returns the unique names of all countries for which models exist.
     """
-    country_names = set()
-    folder_path = "./models"
-    for filename in os.listdir(folder_path):
-        if os.path.isfile(os.path.join(folder_path, filename)) and filename.endswith(".h5"):
-            country_name = filename.split('_')[0]
-            country_names.add(country_name)
-    return list(country_names)
+    return registry.get_countries()
 
 
 def get_latest_model_name_for(country):
     """Returns the latest prediction model version number for a country.
     All models stored in the 'model' folder follow a common file naming convention: "countrycode_version".
     This method returns the value of the highest version available for the given country.
+    If the environment variable `PREDICTIONS_MODEL_SELECTION` is `accuracy`, it returns instead the version with the lowest
+    measured error (see `accuracyTracker.py`). The highest version is still used until enough of its forecasts have been scored,
+    so that a new version is evaluated before it is compared with the previous ones.
     """
-    highestNumber = float('-inf')  # Start with a very low value
-    highestNumberFile = None
-    for fileName in os.listdir("./models"):
-        if fileName.startswith(country + "_v") and fileName.endswith(".h5"):
-            fileNumber = int(fileName.split("_")[1].split(".")[0][1:])
-            if fileNumber > highestNumber:
-                highestNumber = fileNumber
-                highestNumberFile = fileName
-    return highestNumberFile
+    latest = registry.get_latest_model_name(country)
+    if latest is None or os.getenv("PREDICTIONS_MODEL_SELECTION", "latest") != "accuracy":
+        return latest
+    min_count = int(os.getenv("PREDICTIONS_MODEL_SELECTION_MIN_COUNT", 480))
+    scores = accuracy_tracker.get_model_scores(country)
+    if latest not in scores.index or scores.loc[latest, "count"] < min_count:
+        return latest
+    model_names = [name for _, name in registry.get_versions(country)]
+    return accuracy_tracker.get_best_model(country, model_names, min_count) or latest
 
 
 def get_date_range():
@@ -80,27 +77,32 @@ def get_date_range():
     return date_range
 
 
+def get_recent_percent_renewable(country):
+    ''' Returns a pandas DataFrame of the hourly actual percentage of renewable energy collected from the ENTSOE portal for a 
+    specified country over the time period of `get_date_range`. The column 'imputed' is True for the hours filled by `entsoeAPI.refine_data`
+    '''
+    input = get_date_range()
+    return en.get_actual_percent_renewable(
+        country, input["start"], input["end"], True)
+
+
 def get_percent_actual_generation(country, input_sequence):
     ''' Returns a pandas DataFrame of the hourly actual percentage of renewable energy collected from the ENTSOE portal for a 
     specified country over the last n hours. The last hour will be the current hour or hour upto which data is available. 
     The value of n is determined by the input_sequence provided.
     The output from this method serves as input for running the model.
     '''
-    input = get_date_range()
-    data = en.get_actual_percent_renewable(
-        country, input["start"], input["end"], True)
+    data = get_recent_percent_renewable(country)
     # data.to_csv("./data/test-"+country+".csv")
     last_n_rows = data.tail(input_sequence)
     return last_n_rows
 
 
-def run_model(model_name, input) -> pd.DataFrame:
-    """Generates prediction values for the next 48 hours by running the provided model, using the input data. 
-    :param model_name : The file name of a model (without any extension) located within the 'model' folder. E.g "FR_v5"
-    :param input : pd.DataFrame containing the actual percentage of renewable values up to a certain time period in the recent past
-    Predictions are generated for the upcoming 48 hours, starting from the last hour in the input data
+def get_forecast_frame(input, forecast_values) -> pd.DataFrame:
+    """Returns the forecast values as a DataFrame with the start time of each of the forecast hours.
+    :param input : pd.DataFrame used as the input of the model. The forecast starts at the hour after its last 'startTimeUTC'
+    :param forecast_values : the (unrounded) values generated by the forecast engine
     """
-    seq_length = len(input)
     date = input[['startTimeUTC']].copy()
     # Convert 'startTimeUTC' column to datetime
     date['startTimeUTC'] = pd.to_datetime(date['startTimeUTC'])
@@ -108,35 +110,11 @@ def run_model(model_name, input) -> pd.DataFrame:
     last_date = date.iloc[-1]['startTimeUTC']
     # Calculate the next hour
     next_hour = last_date + timedelta(hours=1)
-    # Create a range of 48 hours starting from the next hour
-    next_48_hours = pd.date_range(next_hour, periods=48, freq='H')
-    # Create a DataFrame with the next 48 hours
-    next_48_hours_df = pd.DataFrame(
-        {'startTimeUTC': next_48_hours.strftime('%Y%m%d%H%M')})
-    # print(next_48_hours_df)
-    # Construct the model filename by appending '.h5' to the model name
-    model_filename = "./models/"+model_name
-    # Load the specified model
-    lstm = load_model(model_filename, compile=False)
-    scaler = StandardScaler()
-    percent_renewable = input['percentRenewable']
-    forecast_values_total = []
-    prev_values_total = percent_renewable.values.flatten()
-    for _ in range(48):
-        scaled_prev_values_total = scaler.fit_transform(
-            prev_values_total.reshape(-1, 1))
-        x_pred_total = scaled_prev_values_total[-(
-            seq_length-1):].reshape(1, (seq_length-1), 1)
-        # Make the prediction using the loaded model
-        predicted_value_total = lstm.predict(x_pred_total, verbose=0)
-        # Inverse transform the predicted value
-        predicted_value_total = scaler.inverse_transform(predicted_value_total)
-        forecast_values_total.append(predicted_value_total[0][0])
-        prev_values_total = np.append(prev_values_total, predicted_value_total)
-        prev_values_total = prev_values_total[1:]
+    # Create a range of hours starting from the next hour
+    next_48_hours = pd.date_range(next_hour, periods=len(forecast_values), freq='H')
     # Create a DataFrame
     forecast_df = pd.DataFrame(
-        {'startTimeUTC': next_48_hours_df['startTimeUTC'], 'percentRenewableForecast': forecast_values_total})
+        {'startTimeUTC': next_48_hours.strftime('%Y%m%d%H%M'), 'percentRenewableForecast': forecast_values})
     forecast_df["percentRenewableForecast"] = forecast_df["percentRenewableForecast"].round(
     ).astype(int)
     forecast_df['percentRenewableForecast'] = forecast_df['percentRenewableForecast'].apply(
@@ -144,32 +122,110 @@ def run_model(model_name, input) -> pd.DataFrame:
     return forecast_df
 
 
-def run_latest_model(country) -> dict:
-    """ Returns  predictions by running the latest version of model available for the input country
-    :param country : 2 letter country code
-    :type country : str
-    :return Dictionary { "input": { "country":"", "model":"", "start":"", "end":"",  "percentRenewable":[],  } , "output": <pandas dataframe> }
+def run_model(model_name, input) -> pd.DataFrame:
+    """Generates prediction values for the next 48 hours by running the provided model, using the input data. 
+    :param model_name : The file name of a model (without any extension) located within the 'model' folder. E.g "FR_v5"
+    :param input : pd.DataFrame containing the actual percentage of renewable values up to a certain time period in the recent past
+    Predictions are generated for the upcoming 48 hours, starting from the last hour in the input data
+    """
+    seq_length = len(input)
+    percent_renewable = input['percentRenewable'].values.flatten()
+    model_hash = registry.get_file_hash(model_name)
+    with metrics.stage("inference", model=model_name) as stage:
+        # the forecast is reused if the model already ran with the same input values
+        forecast_values_total = forecast_cache.get(model_name, model_hash, percent_renewable)
+        stage["cached"] = int(forecast_values_total is not None)
+        if forecast_values_total is None:
+            # Get the forecast engine of the model (the model is loaded only if it is not already cached)
+            engine = registry.get_engine(model_name, seq_length)
+            forecast_values_total = engine.forecast(percent_renewable)
+            forecast_cache.put(model_name, model_hash, percent_renewable, forecast_values_total)
+    return get_forecast_frame(input, forecast_values_total)
+
+
+def get_latest_model_input(country) -> dict:
+    """Returns the name of the latest model available for the country along with the input data required to run it
+    and the actual values of the whole time period fetched (used to measure the accuracy of previous forecasts)
+    :return Dictionary { "country":"", "model":"", "input_sequence":n, "input_data":<pandas dataframe>, "actuals":<pandas dataframe> }
     """
     # get the name of the latest model  and its metadata
     model_name = get_latest_model_name_for(country)
     model_meta = get_model_metadata(model_name)
     input_sequence = model_meta["input_sequence"]
-    country = model_meta["country"]
     # get input for the model : last n values of percent renewable
-    input_data = get_percent_actual_generation(country, input_sequence)
-    #print(input_data)
-    input_percentage = input_data["percentRenewable"].tolist()
-    input_start = input_data.iloc[0]["startTimeUTC"]
-    input_end = input_data.iloc[-1]["startTimeUTC"]
-    # run the model
-    output = run_model(model_name, input_data)
+    recent = get_recent_percent_renewable(model_meta["country"])
+    input_data = recent.tail(input_sequence)
+    return {
+        "country": model_meta["country"],
+        "model": model_name,
+        "input_sequence": input_sequence,
+        "input_data": input_data,
+        "actuals": recent[["startTimeUTC", "percentRenewable", "imputed"]]
+    }
+
+
+def get_response(model_input, output) -> dict:
+    """Returns the response of a model run in the format used to store and log predictions
+    :param model_input : Dictionary returned by `get_latest_model_input`
+    :param output : pd.DataFrame with the forecast
+    The actual values of the model input (key "actuals", see `get_latest_model_input`) are passed on when present
+    """
+    input_data = model_input["input_data"]
     return {
         "input": {
-            "country": country,
-            "model": model_name,
-            "percentRenewable": input_percentage,
-            "start": input_start,
-            "end": input_end
+            "country": model_input["country"],
+            "model": model_input["model"],
+            "percentRenewable": input_data["percentRenewable"].tolist(),
+            "hours": input_data["startTimeUTC"].tolist(),
+            "start": input_data.iloc[0]["startTimeUTC"],
+            "end": input_data.iloc[-1]["startTimeUTC"]
         },
-        "output": output
+        "output": output,
+        "actuals": model_input.get("actuals")
     }
+
+
+def run_latest_model(country) -> dict:
+    """ Returns  predictions by running the latest version of model available for the input country
+    :param country : 2 letter country code
+    :type country : str
+    :return Dictionary { "input": { "country":"", "model":"", "start":"", "end":"",  "percentRenewable":[], "hours":[] } , "output": <pandas dataframe>,
+    "actuals": <pandas dataframe> }
+    """
+    model_input = get_latest_model_input(country)
+    # run the model
+    output = run_model(model_input["model"], model_input["input_data"])
+    return get_response(model_input, output)
+
+
+def run_models_grouped(model_inputs) -> list:
+    """Runs several models at once. Models that share the same architecture (input sequence length and layer shapes)
+    are grouped and each forecast step of a group is computed in a single call, so the cost of a run grows
+    with the number of distinct architectures rather than with the number of countries.
+    :param model_inputs : list of dictionaries returned by `get_latest_model_input`
+    :return list of responses (same format as `run_latest_model`) in the order of the input list
+    """
+    groups = {}
+    responses = [None] * len(model_inputs)
+    for position, model_input in enumerate(model_inputs):
+        values = model_input["input_data"]["percentRenewable"].values
+        cached = forecast_cache.get(model_input["model"], registry.get_file_hash(model_input["model"]), values)
+        if cached is not None:
+            # the model already ran with the same input values
+            metrics.record("inference", country=model_input["country"], model=model_input["model"], duration=0.0, cached=1)
+            responses[position] = get_response(model_input, get_forecast_frame(model_input["input_data"], cached))
+            continue
+        signature = registry.get_signature(model_input["model"], len(model_input["input_data"]))
+        groups.setdefault(signature, []).append((position, model_input))
+    for signature, members in groups.items():
+        seq_length = signature[0]
+        engine = registry.get_group_engine([m[1]["model"] for m in members], seq_length)
+        values = np.stack([m[1]["input_data"]["percentRenewable"].values for m in members])
+        with metrics.stage("inference_grouped", country=None, models=len(members), steps=engine.steps):
+            forecast_values = engine.forecast(values)
+        for row, (position, model_input) in enumerate(members):
+            forecast_cache.put(model_input["model"], registry.get_file_hash(model_input["model"]),
+                               model_input["input_data"]["percentRenewable"].values, forecast_values[row])
+            output = get_forecast_frame(model_input["input_data"], forecast_values[row])
+            responses[position] = get_response(model_input, output)
+    return responses
@@ -0,0 +1,181 @@
+"""
+This file contains the prediction store : an SQLite database in which all the forecasts issued by the models are saved.
+
+Each forecast value is a row keyed by (country, startTimeUTC, issuedAt) : the hour that is forecasted and the time at which the
+forecast was generated. Saving a run only inserts its new rows, so the cost of a write does not depend on the size of the history.
+The primary key doubles as an index for range queries on a country and a time period.
+
+The size of the store is bounded :
+- retention : forecasts for hours older than `retention_days` are deleted
+- compaction : for hours older than `keep_all_hours`, only the most recently issued forecast is kept
+
+The prediction files written before the store existed can be imported with `import_file` (done automatically by `savePredictions.py`
+at the first save of each country). Their rows have no model and the modification time of the file as issue time.
+The countries whose file was imported (or had no file) are recorded in the table `imports`, so a file is imported only once,
+even if the retention later empties the store of the country.
+
+The database is stored in `data/store/predictions.db`. The retention can be set with the environment variable `PREDICTIONS_STORE_RETENTION_DAYS`.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+import pandas as pd
+
+
+def to_epoch_seconds(values) -> pd.Series:
+    """Converts a column of start times ('YYYYMMDDhhmm' strings or datetimes, naive datetimes being in UTC) into epoch seconds"""
+    values = pd.Series(values)
+    if values.dtype == object:
+        values = pd.to_datetime(values.astype(str), format='%Y%m%d%H%M', utc=True)
+    else:
+        values = pd.to_datetime(values, utc=True)
+    return values.astype("int64") // 10**9
+
+
+class PredictionStore:
+    """SQLite store of issued forecasts
+    :param db_path : path of the database file
+    :param retention_days : forecasts for hours older than this are deleted. Defaults to `PREDICTIONS_STORE_RETENTION_DAYS` or 30
+    :param keep_all_hours : all the issued forecasts of an hour are kept until the hour is older than this. After that only the latest forecast is kept
+    """
+
+    def __init__(self, db_path="./data/store/predictions.db", retention_days=None, keep_all_hours=72):
+        self.db_path = db_path
+        if retention_days is None:
+            retention_days = float(os.getenv("PREDICTIONS_STORE_RETENTION_DAYS", 30))
+        self.retention_seconds = int(retention_days * 24 * 3600)
+        self.keep_all_seconds = int(keep_all_hours * 3600)
+        self._connection = None
+        self._imported = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Returns the connection to the database, creating the database at the first call"""
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS predictions (
+                country TEXT NOT NULL,
+                startTimeUTC INTEGER NOT NULL,
+                issuedAt INTEGER NOT NULL,
+                model TEXT,
+                percentRenewableForecast INTEGER NOT NULL,
+                PRIMARY KEY (country, startTimeUTC, issuedAt)
+            ) WITHOUT ROWID""")
+            if self._connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'imports'").fetchone() is None:
+                self._connection.execute("""CREATE TABLE imports (
+                    country TEXT PRIMARY KEY,
+                    importedAt INTEGER NOT NULL
+                )""")
+                # stores created before the table existed : countries with forecasts were already imported
+                self._connection.execute("INSERT INTO imports SELECT DISTINCT country, CAST(strftime('%s', 'now') AS INTEGER) FROM predictions")
+            self._connection.commit()
+            self._imported = {row[0] for row in self._connection.execute("SELECT country FROM imports")}
+        return self._connection
+
+    def write(self, country, forecasts, issued_at=None, model=None):
+        """Saves forecasts and then applies the retention and the compaction to the country
+        :param forecasts : pd.DataFrame with the columns 'startTimeUTC' and 'percentRenewableForecast'
+        :param issued_at : time at which the forecasts were generated (datetime in UTC, defaults to now) or a column of such values (one per row)
+        :param model : name of the model that generated the forecasts
+        """
+        if issued_at is None:
+            issued_at = datetime.now(timezone.utc)
+        if isinstance(issued_at, datetime):
+            issued = pd.Series(int(issued_at.timestamp()), index=range(len(forecasts)))
+        else:
+            issued = to_epoch_seconds(issued_at).reset_index(drop=True)
+        rows = zip([country] * len(forecasts),
+                   to_epoch_seconds(forecasts["startTimeUTC"]).tolist(),
+                   issued.tolist(),
+                   [model] * len(forecasts),
+                   forecasts["percentRenewableForecast"].astype(int).tolist())
+        with self._lock:
+            connection = self._connect()
+            connection.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)", rows)
+            self._enforce_limits(connection, country)
+            connection.commit()
+
+    def is_imported(self, country):
+        """Returns True if the prediction file of the country was already imported (see `mark_imported`).
+        The imported countries are read once from the database, so this does not run a query"""
+        with self._lock:
+            self._connect()
+            return country in self._imported
+
+    def mark_imported(self, country):
+        """Records that the prediction file of the country was imported, or that there was no file to import"""
+        with self._lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO imports VALUES (?, ?)", (country, int(datetime.now(timezone.utc).timestamp())))
+            connection.commit()
+            self._imported.add(country)
+
+    def import_file(self, country, file_path):
+        """Imports a prediction csv file (columns startTimeUTC and percentRenewableForecast) written before the store existed.
+        The import is recorded (see `mark_imported`). Returns the number of rows imported"""
+        try:
+            data = pd.read_csv(file_path)
+        except pd.errors.EmptyDataError:
+            data = pd.DataFrame(columns=["startTimeUTC", "percentRenewableForecast"])
+        data = data.dropna(subset=["startTimeUTC", "percentRenewableForecast"])
+        if len(data) > 0:
+            data["startTimeUTC"] = pd.to_datetime(data["startTimeUTC"])
+            issued_at = datetime.fromtimestamp(os.path.getmtime(file_path), timezone.utc)
+            self.write(country, data.drop_duplicates(subset="startTimeUTC", keep="last").reset_index(drop=True), issued_at=issued_at)
+        self.mark_imported(country)
+        return len(data)
+
+    def get_retention_start(self) -> datetime:
+        """Returns the first hour kept by the retention (naive datetime in UTC). Forecasts for earlier hours are deleted at each write"""
+        now = int(datetime.now(timezone.utc).timestamp())
+        return datetime.fromtimestamp(now - self.retention_seconds, timezone.utc).replace(tzinfo=None)
+
+    def _enforce_limits(self, connection, country):
+        """Deletes the forecasts of the country that are older than the retention and the superseded forecasts older than keep_all_hours"""
+        now = int(datetime.now(timezone.utc).timestamp())
+        connection.execute("DELETE FROM predictions WHERE country = ? AND startTimeUTC < ?",
+                           (country, now - self.retention_seconds))
+        connection.execute("""DELETE FROM predictions WHERE country = ? AND startTimeUTC < ? AND issuedAt < (
+                SELECT MAX(p.issuedAt) FROM predictions p WHERE p.country = predictions.country AND p.startTimeUTC = predictions.startTimeUTC)""",
+                           (country, now - self.keep_all_seconds))
+
+    def _query(self, sql, params):
+        with self._lock:
+            data = pd.read_sql_query(sql, self._connect(), params=params)
+        for column in ["startTimeUTC", "issuedAt"]:
+            if column in data.columns:
+                data[column] = pd.to_datetime(data[column], unit="s")
+        return data
+
+    def get_latest(self, country, start, end) -> pd.DataFrame:
+        """Returns the most recently issued forecast of each hour of the country between start and end (both included)
+        :param start, end : datetimes (naive datetimes are in UTC)
+        :return pd.DataFrame with the columns startTimeUTC (naive datetime in UTC) and percentRenewableForecast
+        """
+        return self._query("""SELECT startTimeUTC, percentRenewableForecast FROM predictions p
+            WHERE country = ? AND startTimeUTC BETWEEN ? AND ? AND issuedAt = (
+                SELECT MAX(issuedAt) FROM predictions WHERE country = p.country AND startTimeUTC = p.startTimeUTC)
+            ORDER BY startTimeUTC""", (country, *self._range(start, end)))
+
+    def get_forecasts(self, country, start, end) -> pd.DataFrame:
+        """Returns all the forecasts issued for the hours of the country between start and end (both included)
+        :return pd.DataFrame with the columns startTimeUTC, issuedAt (naive datetimes in UTC), model, percentRenewableForecast and
+        leadTime : the position of the hour in the forecast it belongs to (1 for the first forecast hour). Since the compaction deletes
+        superseded forecasts, lead times are only reliable for hours within `keep_all_hours`
+        """
+        return self._query("""SELECT p.startTimeUTC, p.issuedAt, p.model, p.percentRenewableForecast,
+                (p.startTimeUTC - i.firstHour) / 3600 + 1 AS leadTime
+            FROM predictions p JOIN (
+                SELECT issuedAt, MIN(startTimeUTC) AS firstHour FROM predictions WHERE country = ? GROUP BY issuedAt) i
+            ON p.issuedAt = i.issuedAt
+            WHERE p.country = ? AND p.startTimeUTC BETWEEN ? AND ? ORDER BY p.startTimeUTC, p.issuedAt""",
+                           (country, country, *self._range(start, end)))
+
+    @staticmethod
+    def _range(start, end):
+        return tuple(int(pd.Timestamp(t).tz_localize("UTC").timestamp()) if pd.Timestamp(t).tzinfo is None
+                     else int(pd.Timestamp(t).timestamp()) for t in (start, end))
@@ -0,0 +1,135 @@
+"""
+This file contains the writer used to store predictions in the Redis cache.
+
+All the writes of the process share one connection pool. The predictions of all the countries of a run are written in a single
+MULTI/EXEC transaction, together with an increment of the version key `predictions_version`. After each write, a message
+with the new version and the updated countries is published on the channel `predictions_updates`, so readers can subscribe
+to it (or compare the version key) instead of polling the prediction keys.
+
+The predictions of a country are stored in the key `<country>_predictions`, which expires after `PREDICTIONS_REDIS_TTL_HOURS` hours.
+The value is encoded according to `PREDICTIONS_REDIS_ENCODING` :
+- `json` (default) : the original format, `{"data": {"startTimeUTC": {index: value}, "percentRenewableForecast": {index: value}}, "timeInterval": 60, "last_updated": ""}`
+- `packed` : a header with the start time (UTC epoch seconds, int64), the time interval in minutes (uint16) and the number of values (uint16),
+  followed by the values as int8. The header is little endian, see `header_format`
+- `msgpack` : `{"start": start time (UTC epoch seconds), "timeInterval": 60, "values": [], "last_updated": ""}`. Requires the `msgpack` package
+
+The best start times of jobs of 1 to 48 hours (see `startWindowIndex.py`) are written in the same transaction, in the key `<country>_start_windows`.
+"""
+
+import os
+import json
+import struct
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import redis
+
+from predictionStore import to_epoch_seconds
+import startWindowIndex
+
+encodings = ["json", "packed", "msgpack"]
+header_format = "<qHH"
+version_key = "predictions_version"
+updates_channel = "predictions_updates"
+
+
+def get_key_name(country):
+    return country + "_predictions"
+
+
+def encode_predictions(output, encoding="json", time_interval=60):
+    """Returns the value stored in Redis for the predictions of a country
+    :param output : pd.DataFrame with the columns 'startTimeUTC' and 'percentRenewableForecast'
+    :param encoding : one of `encodings`
+    """
+    values = output["percentRenewableForecast"].astype(int)
+    last_updated = str(datetime.now())
+    if encoding == "json":
+        data = pd.DataFrame({
+            "startTimeUTC": pd.to_datetime(to_epoch_seconds(output["startTimeUTC"]), unit="s").dt.strftime('%Y%m%d%H%M').to_numpy(),
+            "percentRenewableForecast": values.to_numpy()}, index=output.index)
+        return json.dumps({"data": data.to_dict(), "timeInterval": time_interval, "last_updated": last_updated})
+    start = int(to_epoch_seconds(output["startTimeUTC"]).iloc[0]) if len(output) else 0
+    if encoding == "packed":
+        # percentages are between 0 and 100, they fit in a signed byte
+        packed = np.clip(values.to_numpy(), -128, 127).astype(np.int8)
+        return struct.pack(header_format, start, time_interval, len(packed)) + packed.tobytes()
+    if encoding == "msgpack":
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("The msgpack encoding requires the msgpack package (pip install msgpack)")
+        return msgpack.packb({"start": start, "timeInterval": time_interval, "values": values.tolist(), "last_updated": last_updated})
+    raise ValueError(f"Invalid encoding {encoding}, expected one of {encodings}")
+
+
+def decode_packed(value):
+    """Returns (start time as UTC epoch seconds, time interval in minutes, np.array of values) from a value in the packed encoding"""
+    start, time_interval, count = struct.unpack_from(header_format, value)
+    values = np.frombuffer(value, dtype=np.int8, count=count, offset=struct.calcsize(header_format))
+    return start, time_interval, values
+
+
+class RedisWriter:
+    """Writes predictions to Redis using a shared connection pool
+    :param url : URL of the Redis server. Defaults to `PREDICTIONS_REDIS_URL`
+    :param encoding : encoding of the values (see `encodings`). Defaults to `PREDICTIONS_REDIS_ENCODING` or json
+    :param ttl_hours : expiration of the prediction keys. Defaults to `PREDICTIONS_REDIS_TTL_HOURS` or 72. 0 means no expiration
+    """
+
+    def __init__(self, url=None, encoding=None, ttl_hours=None):
+        self.url = url
+        self.encoding = encoding
+        self.ttl_hours = ttl_hours
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get_encoding(self):
+        encoding = self.encoding or os.getenv("PREDICTIONS_REDIS_ENCODING", "json")
+        if encoding not in encodings:
+            raise ValueError(f"Invalid encoding {encoding}, expected one of {encodings}")
+        return encoding
+
+    def get_ttl(self):
+        """Returns the expiration of the prediction keys in seconds (None for no expiration)"""
+        ttl_hours = self.ttl_hours if self.ttl_hours is not None else float(os.getenv("PREDICTIONS_REDIS_TTL_HOURS", 72))
+        return int(ttl_hours * 3600) or None
+
+    def get_client(self):
+        """Returns a client using the shared connection pool. The pool is created at the first call,
+        the environment variables being loaded by then"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = redis.ConnectionPool.from_url(self.url or os.getenv("PREDICTIONS_REDIS_URL"))
+            return redis.Redis(connection_pool=self._pool)
+
+    def ping(self):
+        return self.get_client().ping()
+
+    def write(self, responses):
+        """Stores the predictions of several countries in one transaction and notifies the readers
+        :param responses : list of responses of `predictionModel.get_response`
+        :return the new version number
+        """
+        if not responses:
+            return None
+        encoding = self.get_encoding()
+        ttl = self.get_ttl()
+        countries = [response["input"]["country"] for response in responses]
+        index = startWindowIndex.StartWindowIndex.from_responses(responses)
+        client = self.get_client()
+        with client.pipeline(transaction=True) as pipe:
+            for country, response in zip(countries, responses):
+                pipe.set(get_key_name(country), encode_predictions(response["output"], encoding), ex=ttl)
+                pipe.set(startWindowIndex.get_key_name(country), index.encode(country), ex=ttl)
+            pipe.incr(version_key)
+            version = pipe.execute()[-1]
+        client.publish(updates_channel, json.dumps({"version": version, "countries": countries, "encoding": encoding}))
+        return version
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.disconnect()
+                self._pool = None
@@ -5,10 +5,26 @@ import pandas as pd
 import os
 import datetime
 from datetime import datetime, timedelta
-import redis
-import json
+import argparse
+import atexit
+import signal
+import time
 from dotenv import load_dotenv
 import predictionModel as ml
+import entsoeAPI as en
+from scheduler import Scheduler
+from pipeline import Pipeline
+from predictionStore import PredictionStore, to_epoch_seconds
+from redisWriter import RedisWriter
+from metrics import metrics
+from predictionLog import PredictionLog
+from forecastMatrix import write_forecast_matrix
+
+predictionStore = PredictionStore()
+redisWriter = RedisWriter()
+predictionLog = PredictionLog()
+# buffered log records are written when the process exits, if they were not written at the end of a run
+atexit.register(predictionLog.flush)
 
 
 def loadEnv():
@@ -46,41 +62,18 @@ def check():
 def checkRedis():
     """This method check the availability of Redis server"""
     try:
-        redis_url = os.getenv("PREDICTIONS_REDIS_URL")
-        r = redis.from_url(redis_url)
-        print(r.ping())
+        print(redisWriter.ping())
     except Exception:
         print("Error in connecting to redis server")
 
 
-def getLogFileName(country):
-    """Returns the current  log file name for the specified country. 
-    It the file doesn't exists, a blank file will be created.
-    Logs records are stored in simple text files within the 'logs' folder located inside the 'data' folder. 
-    The names of file have the format : "country code-current month-current year", 
-    guaranteeing a distinct log file for each country and month of the year. 
-    """
-    current_month = datetime.now().strftime('%m')
-    current_year = datetime.now().strftime('%Y')
-    file_name = f"{country}-{current_month}-{current_year}.log"
-    folder_path = "./data/logs"
-    file_path = os.path.join(folder_path, file_name)
-    if not os.path.exists(file_path):
-        open(file_path, 'w').close()
-    return file_path
-
-
 def logPrediction(response):
     """This method logs predictions made by a model. It requires the full response of the run model method
     response format : { "input": { "country":"", "model":"", "start":"", "end":"",  "percentRenewable":[],  } , "output": <pandas dataframe> }
-    Log entry format (single line) : timestamp : model-name input_starttime_UTC  input_endtime_UTC input(percent renewable )[] output[](percent renewable values for next 48 hours)
+    Runs are logged as JSON lines in the `logs` folder located inside the `data` folder, with a file for each country and month
+    (see `predictionLog.py`). Records are buffered and written at the end of the run. Use `predictionLog.query` to load them.
     """
-    logFileName = getLogFileName(response["input"]["country"])
-    ouputString = response["output"]["percentRenewableForecast"].tolist()
-    logString = str(datetime.now())+" : "+response["input"]["model"] + " "+str(response["input"]["start"])+" "+str(
-        response["input"]["end"])+" "+str(response["input"]["percentRenewable"])+" "+str(ouputString)+"\n"
-    with open(logFileName, 'a') as log_file:
-        log_file.write(logString)
+    predictionLog.append(response)
 
 
 def get_start_end_dates():
@@ -90,54 +83,196 @@ def get_start_end_dates():
     return start_date, end_date
 
 
-def savePredictionsToFile(response):
-    file_name = response["input"]["country"]+".csv"
-    folder_path = "./data/predictions"
-    file_path = os.path.join(folder_path, file_name)
-    if not os.path.exists(file_path):
-        open(file_path, 'w').close()
-
+def updateAccuracy(response):
+    """Scores the previous forecasts of the country against the actual values fetched for the run (see `accuracyTracker.py`).
+    Only settled hours are scored : hours filled by `entsoeAPI.refine_data` and hours within the publication lag of the tracker are left out.
+    The number of hours that are missing or imputed is recorded in the metrics (field `missing_hours`).
+    Failures are recorded in the metrics (field `error`) and do not stop the save of the predictions"""
+    inputs = response["input"]
+    if response.get("actuals") is None:
+        return
     try:
-        oldData = pd.read_csv(folder_path+"/"+file_name)
-    except pd.errors.EmptyDataError:
-        oldData = pd.DataFrame(
-            columns=['startTimeUTC', 'percentRenewableForecast'])
+        with metrics.stage("accuracy_update") as stage:
+            actuals = response["actuals"]
+            hours = to_epoch_seconds(actuals["startTimeUTC"])
+            measured = hours[~actuals["imputed"].to_numpy() & actuals["percentRenewable"].notna().to_numpy()]
+            stage["missing_hours"] = int((hours.max() - hours.min()) // 3600 + 1 - measured.nunique()) if len(hours) else 0
+            stage["rows"] = ml.accuracy_tracker.update(inputs["country"], actuals, predictionStore)
+    except Exception as e:
+        print("Error in updating the accuracy of "+inputs["country"]+" : "+repr(e))
 
-    oldData["startTimeUTC"] = pd.to_datetime(oldData['startTimeUTC'])  
+
+def savePredictionsToFile(response):
+    """Stores the predictions in the prediction store (see `predictionStore.py`) and exports the csv file of the country.
+    Only the new predictions are written to the store. The csv file contains the latest prediction of each hour between
+    7 days before and 7 days after today (see `get_start_end_dates`), so its size does not grow over time.
+    """
+    country = response["input"]["country"]
     newData = response["output"]
     newData["startTimeUTC"] = pd.to_datetime(newData['startTimeUTC'])
-    mergedData = pd.concat([oldData, newData]).drop_duplicates(
-        subset="startTimeUTC", keep='last')
+    with metrics.stage("store_write", rows=len(newData)):
+        importPredictionsFile(country)
+        predictionStore.write(country, newData, model=response["input"].get("model"))
+    with metrics.stage("csv_export") as stage:
+        stage["rows"] = exportPredictionsFile(country)
+
+
+def importPredictionsFile(country):
+    """Imports the existing csv file of the country into the prediction store the first time the country is saved,
+    so that the history written before the store existed is kept (see `PredictionStore.import_file`).
+    The import is done once per country : the imported countries are recorded in the store"""
+    if predictionStore.is_imported(country):
+        return 0
+    file_path = os.path.join("./data/predictions", country+".csv")
+    if not os.path.exists(file_path):
+        predictionStore.mark_imported(country)
+        return 0
+    count = predictionStore.import_file(country, file_path)
+    print(f"Imported {count} predictions of {country} from {file_path}")
+    return count
+
 
+def exportPredictionsFile(country):
+    """Writes the csv file of the country with the latest prediction of each hour between 7 days before and 7 days after today.
+    The file is replaced atomically so that readers never see a partial file. Returns the number of rows of the file"""
     start_date, end_date = get_start_end_dates()
-    # Filter the merged DataFrame
-    filteredData = mergedData[(mergedData['startTimeUTC'] >= start_date) & (
-        mergedData['startTimeUTC'] <= end_date)]
-    # filteredData['startTimeUTC'] = filteredData['startTimeUTC'].dt.strftime('%Y%m%d%H%M')
-    # filteredData.to_csv(file_path, index=False, mode='w')
-    mergedData.to_csv(file_path, index=False, mode='w')
+    filteredData = predictionStore.get_latest(country, start_date, end_date)
+    file_path = os.path.join("./data/predictions", country+".csv")
+    filteredData.to_csv(file_path + ".tmp", index=False, mode='w')
+    os.replace(file_path + ".tmp", file_path)
+    return len(filteredData)
 
 
-def savePredictionsToRedis(response):
-    key_name = response["input"]["country"]+"_predictions"
-    newData = response["output"]
-    newData["startTimeUTC"] = newData['startTimeUTC'].dt.strftime('%Y%m%d%H%M').astype("str")
-    last_update = str(datetime.now())
-    cached_object = {
-        "data": newData.to_dict(),
-        "timeInterval": 60,
-        "last_updated": last_update,
-    }
-    # print(cached_object)
-    try : 
-        redis_url = os.getenv("PREDICTIONS_REDIS_URL")
-        r = redis.from_url(redis_url)
-        r.set(key_name, json.dumps(cached_object))
-    except Exception :
-        print("Error in saving data Redis cache")
-
-def main():
-    """This is the main script"""
+def savePredictionsToRedis(responses):
+    """Stores the predictions of one or several countries in the Redis cache in a single transaction (see `redisWriter.py`)
+    :param responses : a response of `predictionModel.get_response` or a list of responses
+    """
+    if isinstance(responses, dict):
+        responses = [responses]
+    try:
+        with metrics.stage("redis_write", country=None, countries=len(responses)):
+            redisWriter.write(responses)
+    except Exception as e:
+        print("Error in saving data Redis cache : "+repr(e))
+
+
+def savePredictionsToMatrix(responses):
+    """Publishes the newest forecasts of all the countries in the memory-mapped forecast matrix file (see `forecastMatrix.py`)"""
+    try:
+        with metrics.stage("matrix_write", country=None) as stage:
+            stage["countries"] = write_forecast_matrix(responses)
+    except Exception as e:
+        print("Error in writing the forecast matrix : "+repr(e))
+
+
+def savePredictions(predictions):
+    """Stores the predictions in the csv file, in the redis server and in the forecast matrix and logs them"""
+    savePredictionsToFile(predictions)
+    savePredictionsToRedis(predictions)
+    savePredictionsToMatrix([predictions])
+    logPrediction(predictions)
+
+
+def getInputKey(model, end, percentRenewable):
+    """Returns a value identifying the input window of a model run : the model, the last hour of input and the input values.
+    Two runs with the same key would generate the same predictions."""
+    return (model, str(end), tuple(percentRenewable))
+
+
+def getWorkers(value, variable, default):
+    """Returns the number of workers of a pipeline stage : the given value, else the environment variable, else the default"""
+    if value is not None:
+        return value
+    return int(os.getenv(variable, default))
+
+
+def runPredictions(countryList, batched=False, lastInputs=None, fetchWorkers=None, saveWorkers=None):
+    """Runs the latest model of each country in the list and stores the predictions.
+    Countries are processed concurrently by a pipeline (see `pipeline.py`) : input data is fetched and predictions are saved
+    in thread pools while models run one at a time. A failure for one country does not stop the others.
+    :param batched : if True, the input data of all countries is collected first and models sharing
+    the same architecture are run together (see `predictionModel.run_models_grouped`)
+    :param lastInputs : dictionary {country : key of the input window used in the previous run} (see `getInputKey`).
+    If provided, countries whose input window has not changed since the previous run are skipped and the dictionary is updated.
+    :param fetchWorkers : maximum number of concurrent fetches. Defaults to `PREDICTIONS_FETCH_WORKERS` or 4
+    :param saveWorkers : maximum number of concurrent saves. Defaults to `PREDICTIONS_SAVE_WORKERS` or 2
+    :return dictionary with the total duration (in seconds) of each stage, the countries run, skipped and failed
+    """
+    def fetch(country):
+        print("Fetching input for "+country)
+        metrics.set_country(country)
+        with metrics.stage("fetch") as stage:
+            modelInput = ml.get_latest_model_input(country)
+            stage["rows"] = len(modelInput["input_data"])
+        return modelInput
+
+    def infer(modelInput):
+        print("Running for "+modelInput["country"])
+        metrics.set_country(modelInput["country"])
+        output = ml.run_model(modelInput["model"], modelInput["input_data"])
+        return ml.get_response(modelInput, output)
+
+    saved = []
+
+    def save(country, predictions):
+        # predictions are sent to Redis once for all the countries, at the end of the run
+        metrics.set_country(country)
+        # the actual values of the input are scored before the new forecasts are stored
+        updateAccuracy(predictions)
+        savePredictionsToFile(predictions)
+        with metrics.stage("log_write"):
+            logPrediction(predictions)
+        saved.append(predictions)
+        if lastInputs is not None:
+            inputs = predictions["input"]
+            lastInputs[country] = getInputKey(inputs["model"], inputs["end"], inputs["percentRenewable"])
+
+    def isUnchanged(country, modelInput):
+        if lastInputs is None:
+            return False
+        inputData = modelInput["input_data"]
+        key = getInputKey(modelInput["model"], inputData.iloc[-1]["startTimeUTC"], inputData["percentRenewable"].tolist())
+        return lastInputs.get(country) == key
+
+    pipeline = Pipeline(fetch, infer, save,
+                        fetch_workers=getWorkers(fetchWorkers, "PREDICTIONS_FETCH_WORKERS", 4),
+                        save_workers=getWorkers(saveWorkers, "PREDICTIONS_SAVE_WORKERS", 2),
+                        infer_batch=ml.run_models_grouped if batched else None)
+    metrics.start_run()
+    ml.forecast_cache.get_stats(reset=True)
+    # identical ENTSOE queries made during the run are downloaded once
+    with en.query_scope():
+        result = pipeline.run(countryList, skip=isUnchanged)
+    start = time.perf_counter()
+    savePredictionsToRedis(saved)
+    savePredictionsToMatrix(saved)
+    with metrics.stage("log_flush", country=None, records=len(saved)):
+        predictionLog.flush()
+    duration = time.perf_counter() - start
+    result["timings"]["save"] += duration
+    result["wall"] += duration
+    if result["skipped"]:
+        print("Skipped (input unchanged since the last run) : "+", ".join(result["skipped"]))
+    if result["errors"]:
+        print("Failed : "+", ".join(f"{country} ({error['stage']})" for country, error in result["errors"].items()))
+    timings = dict(result["timings"])
+    timings.update({"wall": result["wall"], "countries": result["completed"],
+                    "skipped": result["skipped"], "errors": result["errors"]})
+    metrics.record("forecast_cache", country=None, **ml.forecast_cache.get_stats())
+    metrics.record("run", country=None, duration=result["wall"], completed=len(result["completed"]),
+                   skipped=len(result["skipped"]), failed=len(result["errors"]))
+    try:
+        metrics.flush()
+    except Exception as e:
+        print("Error in writing metrics : "+repr(e))
+    return timings
+
+
+def main(batched=False, fetchWorkers=None, saveWorkers=None):
+    """This is the main script
+    :param batched : run models sharing the same architecture together (see `runPredictions`)
+    :param fetchWorkers, saveWorkers : concurrency of the pipeline stages (see `runPredictions`)
+    """
     # load config file
     loadEnv()
     print("Starting checks....")
@@ -145,15 +280,109 @@ def main():
     print("Checks done....")
     # get list of available models 
     countryList = ml.get_available_country_list()
-    for country in countryList:
-        print("Running for "+country)
-        # run model and stored it in csv file and to the redis server and log it
-        predictions = ml.run_latest_model(country)
-        savePredictionsToFile(predictions)
-        savePredictionsToRedis(predictions)
-        logPrediction(predictions)
+    runPredictions(countryList, batched, fetchWorkers=fetchWorkers, saveWorkers=saveWorkers)
     print("Done!")
 
 
+def profileCountry(country, sortBy="cumulative"):
+    """Runs the latest model of a single country under cProfile and stores the predictions.
+    The stages are run one after the other in the current thread so that the profile covers all of them.
+    The profile is saved in `data/metrics/profile-<country>-<time>.prof` (it can be opened with `pstats` or snakeviz)
+    and the 25 most expensive functions are printed.
+    """
+    import cProfile
+    import pstats
+    loadEnv()
+    check()
+    profiler = cProfile.Profile()
+    metrics.start_run()
+    metrics.set_country(country)
+    profiler.enable()
+    try:
+        modelInput = ml.get_latest_model_input(country)
+        output = ml.run_model(modelInput["model"], modelInput["input_data"])
+        savePredictions(ml.get_response(modelInput, output))
+    finally:
+        profiler.disable()
+        metrics.flush()
+    os.makedirs(metrics.folder_path, exist_ok=True)
+    file_path = os.path.join(metrics.folder_path, f"profile-{country}-{datetime.now().strftime('%Y%m%d%H%M%S')}.prof")
+    profiler.dump_stats(file_path)
+    pstats.Stats(profiler).sort_stats(sortBy).print_stats(25)
+    print("Profile saved in "+file_path)
+
+
+def listModels():
+    """Prints the latest model and its input sequence for each available country. TensorFlow is not loaded"""
+    for country in ml.get_available_country_list():
+        model = ml.get_latest_model_name_for(country)
+        print(f"{country} : {model} (input sequence {ml.get_model_metadata(model)['input_sequence']})")
+
+
+def runDaemon(batched=False, interval=None, offset=None, fetchWorkers=None, saveWorkers=None):
+    """Runs the tool as a long running process that generates predictions periodically (see `scheduler.py`).
+    Models stay loaded between runs and countries whose input window has not changed since the previous run are skipped.
+    The process stops gracefully on SIGTERM or SIGINT.
+    :param interval : time between two runs in minutes. Defaults to `PREDICTIONS_DAEMON_INTERVAL_MIN` or 60
+    :param offset : minutes after each interval boundary at which the run starts. Defaults to `PREDICTIONS_DAEMON_OFFSET_MIN` or 15
+    :param fetchWorkers, saveWorkers : concurrency of the pipeline stages (see `runPredictions`)
+    """
+    loadEnv()
+    print("Starting checks....")
+    check()
+    print("Checks done....")
+    if interval is None:
+        interval = int(os.getenv("PREDICTIONS_DAEMON_INTERVAL_MIN", 60))
+    if offset is None:
+        offset = int(os.getenv("PREDICTIONS_DAEMON_OFFSET_MIN", 15))
+    lastInputs = {}
+
+    def job():
+        countryList = ml.get_available_country_list()
+        timings = runPredictions(countryList, batched, lastInputs, fetchWorkers, saveWorkers)
+        print(f"Run timings : fetch {timings['fetch']:.2f}s, inference {timings['inference']:.2f}s, "
+              f"save {timings['save']:.2f}s, total {timings['wall']:.2f}s, {len(timings['countries'])} countries run, "
+              f"{len(timings['skipped'])} skipped, {len(timings['errors'])} failed")
+
+    daemon = Scheduler(job, interval, offset)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run_forever()
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Runs the latest prediction model of each country and stores the predictions")
+    parser.add_argument("--check", action="store_true",
+                        help="only run the checks (environment variables, folders, Redis server) and exit")
+    parser.add_argument("--list", action="store_true",
+                        help="only list the available countries and their latest model and exit")
+    parser.add_argument("--profile", metavar="COUNTRY", default=None,
+                        help="run the model of a single country under cProfile and save the profile in data/metrics")
+    parser.add_argument("--batched", action="store_true",
+                        help="run models that share the same architecture together in a single batched call")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and generate predictions periodically instead of running once")
+    parser.add_argument("--interval", type=int, default=None,
+                        help="daemon mode : minutes between two runs (default : PREDICTIONS_DAEMON_INTERVAL_MIN or 60)")
+    parser.add_argument("--offset", type=int, default=None,
+                        help="daemon mode : minutes after each interval boundary at which runs start (default : PREDICTIONS_DAEMON_OFFSET_MIN or 15)")
+    parser.add_argument("--fetch-workers", type=int, default=None,
+                        help="maximum number of countries fetched concurrently (default : PREDICTIONS_FETCH_WORKERS or 4)")
+    parser.add_argument("--save-workers", type=int, default=None,
+                        help="maximum number of countries saved concurrently (default : PREDICTIONS_SAVE_WORKERS or 2)")
+    args = parser.parse_args()
+    # TensorFlow and the ENTSOE client are only imported once models are run, so these options return quickly
+    if args.check or args.list:
+        # the config is needed by --list as well, since it can change the model selection (PREDICTIONS_MODEL_SELECTION)
+        loadEnv()
+        if args.check:
+            check()
+        if args.list:
+            listModels()
+    elif args.profile:
+        profileCountry(args.profile)
+    elif args.daemon:
+        runDaemon(batched=args.batched, interval=args.interval, offset=args.offset,
+                  fetchWorkers=args.fetch_workers, saveWorkers=args.save_workers)
+    else:
+        main(batched=args.batched, fetchWorkers=args.fetch_workers, saveWorkers=args.save_workers)
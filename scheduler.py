@@ -0,0 +1,68 @@
+"""
+This file contains the scheduler used to run the prediction tool as a long running process (daemon mode).
+
+Instead of starting a new container for every run, the process stays alive so that the Python interpreter, TensorFlow and the
+models are loaded only once. The scheduler wakes up at fixed times : every `interval` minutes (counted from midnight)
+plus an `offset` in minutes. The offset lets runs start once new ENTSOE data is expected to be published.
+For example, with an interval of 60 and an offset of 15, the runs start at 00:15, 01:15, 02:15...
+
+The scheduler stops gracefully : when `stop()` is called (e.g. on SIGTERM), the current run completes and no new run is started.
+"""
+
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+
+def get_next_run_time(now, interval_min, offset_min):
+    """Returns the first time after `now` that is a multiple of `interval_min` minutes after midnight plus `offset_min` minutes"""
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed_min = (now - midnight).total_seconds() / 60 - offset_min
+    slots = int(elapsed_min // interval_min) + 1
+    return midnight + timedelta(minutes=offset_min + slots * interval_min)
+
+
+class Scheduler:
+    """Calls a function periodically until stopped.
+    :param job : function called at every run. Exceptions raised by the job are printed and do not stop the scheduler
+    :param interval_min : time between two runs, in minutes
+    :param offset_min : offset of the runs (in minutes) with respect to the interval boundaries
+    :param run_at_start : if True, the job is run once as soon as the scheduler starts
+    """
+
+    def __init__(self, job, interval_min=60, offset_min=15, run_at_start=True):
+        self.job = job
+        self.interval_min = interval_min
+        self.offset_min = offset_min
+        self.run_at_start = run_at_start
+        self._stop_event = threading.Event()
+
+    def stop(self, *args):
+        """Requests the scheduler to stop after the current run. The signature allows it to be used as a signal handler"""
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def _run_job(self):
+        start = time.perf_counter()
+        try:
+            self.job()
+        except Exception:
+            print("Error in scheduled run")
+            traceback.print_exc()
+        print(f"Run completed in {time.perf_counter() - start:.2f}s")
+
+    def run_forever(self):
+        """Runs the job at the scheduled times until `stop()` is called"""
+        if self.run_at_start:
+            self._run_job()
+        while not self.stopped():
+            next_run = get_next_run_time(datetime.now(), self.interval_min, self.offset_min)
+            print("Next run at "+str(next_run))
+            # wait until the next run or until the scheduler is stopped
+            if self._stop_event.wait(max(0, (next_run - datetime.now()).total_seconds())):
+                break
+            self._run_job()
+        print("Scheduler stopped")
@@ -0,0 +1,145 @@
+"""
+This file contains the index of the best start times of jobs. It answers the question of the Codegreen clients :
+"when should a job of D hours start in country C to use the highest percentage of renewable energy ?"
+
+For each country and each job duration D from 1 to 48 hours, the index stores the start of the D hour window of the forecast
+with the highest mean percentage of renewable energy (the earliest one if several windows have the same mean) along with that mean.
+The index is built once per run from the 48 hour forecasts : the sum of every window is the difference of two prefix sums,
+and the best window of each duration is the maximum over the sliding windows of that duration, computed for all countries and
+durations in a few array operations. A lookup is then a single array access instead of a scan of the forecast.
+
+The index of each country is published in Redis next to its predictions (key `<country>_start_windows`, see `redisWriter.py`) as JSON :
+{"start" : first forecast hour ('YYYYMMDDhhmm' in UTC), "timeInterval" : 60, "bestStart" : [offset in hours of the best start for D = 1, 2 ...],
+"percentRenewable" : [mean percentage of renewable energy of the best window for D = 1, 2 ...], "last_updated" : ""}
+"""
+
+import json
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from predictionStore import to_epoch_seconds
+
+
+def get_key_name(country):
+    """Returns the Redis key of the index of the country"""
+    return country + "_start_windows"
+
+
+def get_best_windows(values, max_duration=None):
+    """Returns the best start of each job duration for a batch of forecasts
+    :param values : array of shape (countries, hours) or (hours,) with the forecast percentage of renewable energy
+    :param max_duration : longest job duration (default : the number of forecast hours)
+    :return (best_start, best_mean) : arrays of shape (countries, max_duration) (or (max_duration,)) where column D-1 is the offset
+    of the best start (in hours from the first forecast hour) and the mean percentage of renewable energy of the best window of D hours
+    """
+    values = np.asarray(values, dtype=np.float64)
+    single = values.ndim == 1
+    values = values.reshape(-1, values.shape[-1])
+    hours = values.shape[1]
+    max_duration = hours if max_duration is None else min(max_duration, hours)
+    prefix = np.zeros((values.shape[0], hours + 1))
+    np.cumsum(values, axis=1, out=prefix[:, 1:])
+    durations = np.arange(1, max_duration + 1)
+    starts = np.arange(hours)
+    ends = starts[None, :] + durations[:, None]
+    valid = ends <= hours
+    # sums[c, d, s] : sum of the forecast of country c over the window of durations[d] hours starting at hour s
+    sums = prefix[:, np.minimum(ends, hours)] - prefix[:, starts][:, None, :]
+    sums[:, ~valid] = -np.inf
+    best_start = np.argmax(sums, axis=2)
+    best_mean = np.take_along_axis(sums, best_start[..., None], axis=2)[..., 0] / durations
+    if single:
+        return best_start[0], best_mean[0]
+    return best_start, best_mean
+
+
+class StartWindowIndex:
+    """Best start times of jobs of 1 to 48 hours for several countries
+    :param countries : list of country codes
+    :param start : array with the first forecast hour of each country (UTC epoch seconds)
+    :param best_start, best_mean : arrays returned by `get_best_windows` (one row per country)
+    """
+
+    def __init__(self, countries, start, best_start, best_mean, time_interval=60):
+        self.countries = list(countries)
+        self.positions = {country: i for i, country in enumerate(self.countries)}
+        self.start = np.asarray(start, dtype=np.int64)
+        self.best_start = np.asarray(best_start, dtype=np.int64)
+        self.best_mean = np.asarray(best_mean, dtype=np.float64)
+        self.time_interval = time_interval
+
+    @property
+    def max_duration(self):
+        return self.best_start.shape[1]
+
+    @classmethod
+    def from_responses(cls, responses):
+        """Builds the index from the responses of a run (see `predictionModel.get_response`). All the forecasts must have the same length"""
+        countries = [response["input"]["country"] for response in responses]
+        outputs = [response["output"] for response in responses]
+        start = [int(to_epoch_seconds(output["startTimeUTC"]).iloc[0]) for output in outputs]
+        values = np.stack([output["percentRenewableForecast"].to_numpy(dtype=np.float64) for output in outputs]) \
+            if outputs else np.empty((0, 48))
+        best_start, best_mean = get_best_windows(values)
+        return cls(countries, start, best_start, best_mean)
+
+    def encode(self, country):
+        """Returns the JSON value published for the country"""
+        i = self.positions[country]
+        return json.dumps({
+            "start": pd.Timestamp(self.start[i], unit="s").strftime('%Y%m%d%H%M'),
+            "timeInterval": self.time_interval,
+            "bestStart": self.best_start[i].tolist(),
+            "percentRenewable": np.round(self.best_mean[i], 2).tolist(),
+            "last_updated": str(datetime.now()),
+        })
+
+    @classmethod
+    def decode(cls, values):
+        """Builds the index from the published values
+        :param values : dictionary {country : JSON value}. Countries without a value (None) are left out
+        """
+        values = {country: json.loads(value) for country, value in values.items() if value is not None}
+        countries = list(values)
+        start = [pd.Timestamp(values[c]["start"], tz="UTC").value // 10**9 for c in countries]
+        best_start = [values[c]["bestStart"] for c in countries]
+        best_mean = [values[c]["percentRenewable"] for c in countries]
+        time_interval = values[countries[0]]["timeInterval"] if countries else 60
+        return cls(countries, start, np.array(best_start).reshape(len(countries), -1),
+                   np.array(best_mean).reshape(len(countries), -1), time_interval)
+
+    @classmethod
+    def from_redis(cls, client, countries):
+        """Reads the published index of the countries with a single Redis command"""
+        keys = [get_key_name(country) for country in countries]
+        return cls.decode(dict(zip(countries, client.mget(keys)))) if keys else cls.decode({})
+
+    def query(self, country, duration):
+        """Returns the best start of a job of `duration` hours in the country
+        :return dictionary {"startTimeUTC": 'YYYYMMDDhhmm', "percentRenewable": mean percentage of renewable energy during the job}
+        """
+        if not 1 <= duration <= self.max_duration:
+            raise ValueError(f"The duration must be between 1 and {self.max_duration} hours")
+        i = self.positions[country]
+        offset = self.best_start[i, duration - 1]
+        start = pd.Timestamp(self.start[i] + offset * self.time_interval * 60, unit="s")
+        return {"startTimeUTC": start.strftime('%Y%m%d%H%M'), "percentRenewable": float(self.best_mean[i, duration - 1])}
+
+    def query_batch(self, countries, durations) -> pd.DataFrame:
+        """Answers many queries at once
+        :param countries, durations : lists of the same length (query i is a job of durations[i] hours in countries[i])
+        :return pd.DataFrame with the columns country, duration, startTimeUTC and percentRenewable (one row per query)
+        """
+        durations = np.asarray(durations, dtype=np.int64)
+        if len(durations) and (durations.min() < 1 or durations.max() > self.max_duration):
+            raise ValueError(f"The durations must be between 1 and {self.max_duration} hours")
+        rows = np.array([self.positions[country] for country in countries], dtype=np.int64)
+        offsets = self.best_start[rows, durations - 1]
+        start = pd.to_datetime(self.start[rows] + offsets * self.time_interval * 60, unit="s")
+        return pd.DataFrame({
+            "country": list(countries),
+            "duration": durations,
+            "startTimeUTC": start.strftime('%Y%m%d%H%M'),
+            "percentRenewable": self.best_mean[rows, durations - 1],
+        })